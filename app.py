@@ -1,36 +1,187 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session
-import folium
-from trail_db import init_db, view_stories, submit_story, cheer_story, view_archived_stories, pick_winner, get_prize_pool, get_leaderboard, get_random_story_snippet, subscribe_user, get_existing_users, get_user_subscription
-from trail_security import validate_username, validate_title, validate_story
+from flask import Flask, render_template, request, redirect, url_for, jsonify, session, g, Response, abort, make_response
+from werkzeug.http import is_resource_modified
+from werkzeug.middleware.proxy_fix import ProxyFix
+from trail_db import init_db, view_stories_page, get_story, get_map_markers, submit_story, cheer_story, view_archived_stories, get_winner_info, search_stories, get_prize_pool, get_leaderboard, get_random_story_snippet, login_or_register, get_user_subscription, get_data_version
+from trail_security import validate_username
+from trail_validation import check_submission, MAX_TITLE_CHARS, MAX_STORY_CHARS
 from trail_payments import PaymentHandler
+from trail_jobs import ensure_worker
+from trail_logging import configure_logging
+from trail_cache import TTLCache
+from trail_ratelimit import take_token
+import re
+import trail_metrics
+from datetime import datetime, date, timezone
+import functools
+import math
 import os
+import time
 import logging
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "your-secret-key-here")
-logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
+# Reject oversized POST bodies before form parsing; url-encoding can triple the text size
+app.config["MAX_CONTENT_LENGTH"] = (MAX_TITLE_CHARS + MAX_STORY_CHARS) * 3 + 4096
+configure_logging()
+# Number of reverse proxies in front of the app, so rate limits see the client
+# address from X-Forwarded-For rather than the proxy's. Defaults to 1 for Render;
+# set TRUSTED_PROXIES=0 when clients connect directly, or they could pick their
+# own address (and login bucket) through the header
+TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", 1))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+logging.info(f"Trusting {TRUSTED_PROXIES} proxies for client addresses")
+# When set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+# Seconds the subscription flag cached in the session is trusted before users is
+# queried again; bounds how long a webhook cancellation takes to show
+SESSION_SUBSCRIPTION_TTL = int(os.environ.get("SESSION_SUBSCRIPTION_TTL", 60))
 
 stripe_handler = PaymentHandler(os.environ.get("STRIPE_SECRET_KEY"))
+SUBSCRIPTION_PRICE_ID = "price_1R5aVbP5TKnthUKZOwtyFyPt"
+
+# Rendered folium map, rebuilt only when the published stories change
+_map_cache = {"signature": None, "html": None}
+
+# Rendered HTML of the public read pages, keyed by URL and the data version
+# that trail_db bumps on every write
+PAGE_CACHE_TTL = int(os.environ.get("PAGE_CACHE_TTL", 300))
+PAGE_MAX_AGE = int(os.environ.get("PAGE_MAX_AGE", 0))
+# Part of every ETag, so a deploy with new templates doesn't keep answering 304
+BUILD_ID = os.environ.get("RENDER_GIT_COMMIT", "")[:12]
+_page_cache = TTLCache(maxsize=512, ttl=PAGE_CACHE_TTL)
 
 # Initialize DB at startup
 logging.info("Starting app - initializing database")
 init_db()
 logging.info("Database initialization completed")
+# Applies queued Stripe events off the request path (see trail_jobs)
+ensure_worker()
 
-@app.route('/')
-def home():
+CHECKOUT_SESSION_ID = re.compile(r"cs_[A-Za-z0-9_]{1,250}")
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    trail_metrics.start_request()
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_start' in g:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        stats = trail_metrics.request_stats()
+        trail_metrics.observe("union_route_seconds", time.perf_counter() - g.request_start,
+                              "Route latency", route=route, method=request.method)
+        trail_metrics.observe("union_route_queries", stats["queries"], "SQL statements per request",
+                              buckets=(0, 1, 2, 5, 10, 20, 50, 100), route=route)
+        trail_metrics.observe("union_route_sql_seconds", stats["sql_seconds"], "SQL time per request", route=route)
+        trail_metrics.inc("union_route_rows_total", stats["rows"], "Rows fetched by route", route=route)
+        trail_metrics.inc("union_route_responses_total", 1, "Responses by status", route=route, status=response.status_code)
+    # Throttled; shares this worker's counts so any worker can answer /metrics.
+    # Native ASGI routes skip it: it's a SQLite write and they run on the event loop
+    if not g.get('on_event_loop'):
+        trail_metrics.flush()
+    return response
+
+@app.route('/metrics')
+def metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return Response("Forbidden\n", status=403, mimetype="text/plain")
+    return Response(trail_metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+def cached_page(view):
+    """Serve a session-independent GET page with ETag/Last-Modified, 304s and the rendered-HTML cache."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        data_version = get_data_version()
+        if data_version is None:
+            return view(*args, **kwargs)
+        version, updated_at = data_version
+        # The date is part of the validator because /winner also changes when the month turns
+        today = date.today()
+        etag = "-".join(part for part in (BUILD_ID, str(version), today.isoformat()) if part)
+        midnight = datetime.combine(today, datetime.min.time()).timestamp()
+        last_modified = datetime.fromtimestamp(max(updated_at, midnight), timezone.utc)
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            trail_metrics.inc("union_page_cache_total", 1, "Cached page lookups", result="not_modified")
+            response = Response(status=304)
+        else:
+            key = (request.full_path, etag)
+            html = _page_cache.get(key)
+            trail_metrics.inc("union_page_cache_total", 1, "Cached page lookups", result="miss" if html is None else "hit")
+            if html is None:
+                html = view(*args, **kwargs)
+                _page_cache.set(key, html)
+            response = make_response(html)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = PAGE_MAX_AGE
+        return response
+    return wrapper
+
+def rate_limited(route, per_user=True):
+    """Reject POSTs over the route's token bucket with 429; keyed by user when logged in, else by IP."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method == 'POST':
+                identity = f"user:{session['user_id']}" if per_user and 'user_id' in session else f"ip:{request.remote_addr}"
+                allowed, retry_after = take_token(route, identity)
+                if not allowed:
+                    trail_metrics.inc("union_rate_limited_total", 1, "Requests rejected by rate limits", route=route)
+                    return Response("Too many requests, try again shortly / Demasiadas solicitudes, intenta de nuevo en breve\n",
+                                    status=429, mimetype="text/plain", headers={"Retry-After": str(math.ceil(retry_after))})
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def remember_subscription(subscribed):
+    session['subscribed'] = bool(subscribed)
+    session['subscribed_checked_at'] = time.time()
+    if subscribed:
+        session.pop('checkout_pending', None)
+
+def session_subscribed(refresh=False):
+    """The logged-in user's subscription state from the session, re-read from users once stale.
+
+    While a checkout is pending (the job worker applies it) it is re-read on every call.
+    """
+    if 'username' not in session:
+        return False
+    checked_at = session.get('subscribed_checked_at', 0)
+    if refresh or session.get('checkout_pending') or time.time() - checked_at >= SESSION_SUBSCRIPTION_TTL:
+        remember_subscription(get_user_subscription(session['username']))
+    return session.get('subscribed', False)
+
+def render_home(error=None):
     prize_pool = get_prize_pool()
     winners_share = prize_pool * (2/3)
     quote = get_random_story_snippet() or "Kindness is the sunshine that brightens the world."
-    subscribed = get_user_subscription(session.get('username')) if 'username' in session else False
-    return render_template('home.html', prize_pool=prize_pool, winners_share=winners_share, quote=quote, subscribed=subscribed)
+    subscribed = session_subscribed()
+    return render_template('home.html', error=error, prize_pool=prize_pool, winners_share=winners_share, quote=quote, subscribed=subscribed)
+
+@app.route('/')
+def home():
+    return render_home()
 
 @app.route('/stories')
+@cached_page
 def stories():
-    stories = view_stories()
-    return render_template('stories.html', stories=stories)
+    before = request.args.get('before', type=int)
+    stories, next_cursor = view_stories_page(before_id=before)
+    return render_template('stories.html', stories=stories, next_cursor=next_cursor)
+
+@app.route('/story/<int:story_id>')
+@cached_page
+def story_detail(story_id):
+    story = get_story(story_id)
+    if story is None:
+        abort(404)
+    return render_template('story.html', story=story, archived=False)
 
 @app.route('/submit', methods=['GET', 'POST'])
+@rate_limited('submit')
 def submit():
     if 'username' not in session:
         return redirect(url_for('home'))
@@ -39,8 +190,9 @@ def submit():
         story = request.form['story']
         location = request.form.get('location', '')
         logging.debug(f"Submit attempt: title='{title}', story='{story[:50]}...', location='{location}'")
-        if validate_title(title) and validate_story(story):
-            result = submit_story(session['username'], title, story, location=location)
+        validation = check_submission(title, story)
+        if validation.valid:
+            result = submit_story(session['username'], title, story, location=location, validation=validation)
             if "successfully" in result:
                 logging.info(f"Story submitted by {session['username']}: {title}")
                 return redirect(url_for('stories'))
@@ -48,11 +200,12 @@ def submit():
                 logging.error(f"Submit failed: {result}")
                 return render_template('submit.html', error=result)
         else:
-            logging.error(f"Validation failed: title_valid={validate_title(title)}, story_valid={validate_story(story)}")
+            logging.error(f"Validation failed: field={validation.field}, reason={validation.reason}, offset={validation.offset}")
             return render_template('submit.html', error="Invalid input")
     return render_template('submit.html')
 
 @app.route('/cheer/<int:story_id>', methods=['POST'])
+@rate_limited('cheer')
 def cheer(story_id):
     if 'username' not in session:
         return redirect(url_for('home'))
@@ -61,92 +214,114 @@ def cheer(story_id):
     return redirect(url_for('stories'))
 
 @app.route('/archive')
+@cached_page
 def archive():
     archived_stories = view_archived_stories()
     return render_template('archive.html', archived_stories=archived_stories)
 
+@app.route('/archive/<int:story_id>')
+@cached_page
+def archived_story_detail(story_id):
+    story = get_story(story_id, archived=True)
+    if story is None:
+        abort(404)
+    return render_template('story.html', story=story, archived=True)
+
+@app.route('/search')
+def search():
+    query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    results, has_more = search_stories(query, page=page) if query else ([], False)
+    return render_template('search.html', query=query, results=results, page=page, has_more=has_more)
+
 @app.route('/winner')
+@cached_page
 def winner():
-    winner_info = pick_winner()
+    winner_info = get_winner_info()
     return render_template('winner.html', winner_info=winner_info)
 
 @app.route('/leaderboard')
+@cached_page
 def leaderboard():
-    leaders = get_leaderboard()
-    return render_template('leaderboard.html', leaders=leaders)
+    month = request.args.get('month', '')
+    leaders = get_leaderboard(month=month)
+    return render_template('leaderboard.html', leaders=leaders, month=month)
 
 @app.route('/map')
+@cached_page
 def map():
-    m = folium.Map(location=[20, 0], zoom_start=2, tiles="OpenStreetMap")
-    stories = view_stories()
-    for story in stories:
-        _, title, _, _, username, _, _, location = story
-        if location:
-            loc_key = location.lower().strip()
-            coords = {
-                "usa": (37.0902, -95.7129), "canada": (56.1304, -106.3468), "uk": (55.3781, -3.4360),
-                "france": (46.6034, 1.8883), "brazil": (-14.2350, -51.9253), "australia": (-25.2744, 133.7751),
-                "miami lakes, fl": (25.9087, -80.3087)
-            }.get(loc_key, (random.uniform(-90, 90), random.uniform(-180, 180)))
-            folium.Marker(coords, popup=f"{title} by {username or 'Anonymous'}").add_to(m)
-    map_html = m._repr_html_()
-    return render_template('map.html', map_html=map_html)
+    # Bumped by story writes (including title and location edits) but not by cheers
+    signature = get_data_version("stories")
+    if signature is None or _map_cache["html"] is None or _map_cache["signature"] != signature:
+        import folium  # heavy; loaded on the first map render rather than at worker boot
+        m = folium.Map(location=[20, 0], zoom_start=2, tiles="OpenStreetMap")
+        for lat, lon, title, username in get_map_markers():
+            folium.Marker((lat, lon), popup=f"{title} by {username or 'Anonymous'}").add_to(m)
+        _map_cache["html"] = m._repr_html_()
+        _map_cache["signature"] = signature
+        logging.info(f"Map re-rendered for {signature}")
+    return render_template('map.html', map_html=_map_cache["html"])
 
 @app.route('/login', methods=['POST'])
+@rate_limited('login', per_user=False)
 def login():
     username = request.form.get('username', '').strip()
     logging.debug(f"Login attempt with username: {username}")
     if not username:
         logging.error("No username provided")
-        prize_pool = get_prize_pool()
-        winners_share = prize_pool * (2/3)
-        quote = get_random_story_snippet() or "Kindness is the sunshine that brightens the world."
-        return render_template('home.html', error="Please enter a username / Ingresa un nombre de usuario", 
-                               prize_pool=prize_pool, winners_share=winners_share, quote=quote)
+        return render_home(error="Please enter a username / Ingresa un nombre de usuario")
     if not validate_username(username):
         logging.error(f"Invalid username format: {username}")
-        prize_pool = get_prize_pool()
-        winners_share = prize_pool * (2/3)
-        quote = get_random_story_snippet() or "Kindness is the sunshine that brightens the world."
-        return render_template('home.html', error="Invalid username format / Formato de nombre de usuario inválido", 
-                               prize_pool=prize_pool, winners_share=winners_share, quote=quote)
-    existing_users = get_existing_users()
-    logging.debug(f"Existing users: {existing_users}")
-    if username in existing_users:
-        session['username'] = username
-        logging.info(f"User logged in: {username}")
-    else:
-        from trail_db import register_user
-        result = register_user(username, f"{username}@example.com")
-        if "Welcome" in result or "Bienvenido" in result:
-            session['username'] = username
-            logging.info(f"New user registered and logged in: {username}")
-        else:
-            logging.error(f"Registration failed: {result}")
-            prize_pool = get_prize_pool()
-            winners_share = prize_pool * (2/3)
-            quote = get_random_story_snippet() or "Kindness is the sunshine that brightens the world."
-            return render_template('home.html', error=result, prize_pool=prize_pool, winners_share=winners_share, quote=quote)
+        return render_home(error="Invalid username format / Formato de nombre de usuario inválido")
+    user_id, subscribed, error = login_or_register(username)
+    if error:
+        logging.error(f"Registration failed: {error}")
+        return render_home(error=error)
+    session['username'] = username
+    # Cached for the session so later requests don't re-query users
+    session['user_id'] = user_id
+    remember_subscription(subscribed)
+    logging.info(f"User logged in: {username}")
     return redirect(url_for('home'))
 
 @app.route('/subscribe', methods=['POST'])
 def subscribe():
     if 'username' not in session:
         return redirect(url_for('home'))
-    url, error = stripe_handler.create_subscription(session['username'], price_id="price_1R5aVbP5TKnthUKZOwtyFyPt")
+    url, error = stripe_handler.create_subscription(session['username'], price_id=SUBSCRIPTION_PRICE_ID)
     if url:
+        # Lets /success check one checkout with Stripe per visit here
+        session['checkout_started'] = True
         return redirect(url)
     return jsonify({"error": error}), 500
 
+@app.route('/stripe/webhook', methods=['POST'])
+def stripe_webhook():
+    event, error = stripe_handler.parse_webhook(request.get_data(), request.headers.get('Stripe-Signature', ''))
+    if error:
+        logging.error(f"Stripe webhook rejected: {error}")
+        return jsonify({"error": error}), 400
+    stripe_handler.queue_webhook(event)
+    return jsonify({"received": True})
+
 @app.route('/success')
 def success():
-    if 'username' in session:
-        subscribe_user(session['username'])
-    return render_template('success.html')
+    # The redirect proves nothing; the subscription is granted by the webhook or by
+    # a background check of the session with Stripe
+    session_id = request.args.get('session_id', '')
+    # Only for a checkout this user started, so /success can't be used to make Stripe calls at will
+    if 'username' in session and session.pop('checkout_started', False) and CHECKOUT_SESSION_ID.fullmatch(session_id):
+        stripe_handler.queue_checkout_check(session_id)
+        session['checkout_pending'] = True
+    subscribed = session_subscribed(refresh=True)
+    return render_template('success.html', subscribed=subscribed)
 
 @app.route('/logout')
 def logout():
     session.pop('username', None)
+    session.pop('user_id', None)
+    for key in ('subscribed', 'subscribed_checked_at', 'checkout_pending'):
+        session.pop(key, None)
     logging.info("User logged out")
     return redirect(url_for('home'))
 
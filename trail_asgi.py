@@ -0,0 +1,136 @@
+"""ASGI serving mode for the union app.
+
+Run with an ASGI server, e.g.:
+
+    uvicorn trail_asgi:application --workers 2
+    gunicorn -k uvicorn.workers.UvicornWorker trail_asgi:application
+
+The Flask routes in app.py run unchanged on the bounded executor from
+trail_async, so the event loop can hold many slow connections while only
+ASYNC_DB_WORKERS threads touch SQLite. Routes in ASYNC_ROUTES are served
+natively instead; /subscribe awaits Stripe without tying up a thread.
+"""
+import io
+import sys
+import logging
+from flask import g, session, redirect, url_for, jsonify
+from werkzeug.test import run_wsgi_app
+from app import app, stripe_handler, SUBSCRIPTION_PRICE_ID
+from trail_async import run_db, shutdown_executors
+
+def _build_environ(scope, body):
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+            key = name
+        else:
+            key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    environ.setdefault("CONTENT_LENGTH", str(len(body)))
+    return environ
+
+def _call_wsgi(environ):
+    app_iter, status, headers = run_wsgi_app(app, environ, buffered=True)
+    try:
+        body = b"".join(app_iter)
+    finally:
+        if hasattr(app_iter, "close"):
+            app_iter.close()
+    return int(status.split(" ", 1)[0]), headers.to_wsgi_list(), body
+
+async def subscribe(environ):
+    # Same before/after hooks and session save as a WSGI request, so route
+    # metrics and the session cookie behave the same for native routes. The
+    # hooks only touch memory here: on_event_loop skips the metrics flush,
+    # which the next WSGI request in this process does instead
+    with app.request_context(environ):
+        g.on_event_loop = True
+        response = app.preprocess_request()
+        if response is None:
+            if 'username' not in session:
+                response = redirect(url_for('home'))
+            else:
+                url, error = await stripe_handler.create_subscription_async(session['username'], price_id=SUBSCRIPTION_PRICE_ID)
+                if url:
+                    session['checkout_started'] = True
+                    response = redirect(url)
+                else:
+                    response = (jsonify({"error": error}), 500)
+        response = app.process_response(app.make_response(response))
+        return response.status_code, response.headers.to_wsgi_list(), response.get_data()
+
+ASYNC_ROUTES = {
+    ("POST", "/subscribe"): subscribe,
+}
+
+async def _read_body(receive, limit):
+    """Return the request body, None if the client disconnected, or False once it exceeds limit."""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if limit is not None and size > limit:
+            # Stop buffering; Flask's MAX_CONTENT_LENGTH guard never sees this request
+            return False
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            shutdown_executors()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    body = await _read_body(receive, app.config.get("MAX_CONTENT_LENGTH"))
+    if body is None:
+        return
+    handler = ASYNC_ROUTES.get((scope["method"], scope["path"]))
+    try:
+        if body is False:
+            status, headers, content = 413, [("Content-Type", "text/plain")], b"Request Entity Too Large"
+        elif handler:
+            status, headers, content = await handler(_build_environ(scope, body))
+        else:
+            status, headers, content = await run_db(_call_wsgi, _build_environ(scope, body))
+    except Exception as e:
+        logging.error(f"ASGI request {scope['method']} {scope['path']} failed: {e}")
+        status, headers, content = 500, [("Content-Type", "text/plain")], b"Internal Server Error"
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+    })
+    await send({"type": "http.response.body", "body": content})
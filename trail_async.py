@@ -0,0 +1,26 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Threads that run Flask routes and trail_db calls in async mode; each keeps
+# its own pooled SQLite connection (see trail_conn), so the bound is also the
+# number of open connections per process.
+ASYNC_DB_WORKERS = int(os.environ.get("ASYNC_DB_WORKERS", 8))
+# Kept separate so slow Stripe calls can't starve the database threads
+ASYNC_PAYMENT_WORKERS = int(os.environ.get("ASYNC_PAYMENT_WORKERS", 4))
+
+_db_executor = ThreadPoolExecutor(max_workers=ASYNC_DB_WORKERS, thread_name_prefix="trail-db")
+_payment_executor = ThreadPoolExecutor(max_workers=ASYNC_PAYMENT_WORKERS, thread_name_prefix="trail-payment")
+
+async def run_db(func, *args, **kwargs):
+    """Await a blocking trail_db (or WSGI) call on the bounded database executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, lambda: func(*args, **kwargs))
+
+async def run_payment(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_payment_executor, lambda: func(*args, **kwargs))
+
+def shutdown_executors():
+    _db_executor.shutdown(wait=False)
+    _payment_executor.shutdown(wait=False)
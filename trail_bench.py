@@ -0,0 +1,237 @@
+"""Load-test and micro-benchmark harness.
+
+    python trail_bench.py                          # seed, run, print results
+    python trail_bench.py --save-baseline          # also write bench_baseline.json
+    python trail_bench.py --compare                # fail if p50 regressed past --tolerance
+    python trail_bench.py --import-report          # web worker import time vs --import-budget-ms
+
+Everything runs against a synthetic database in a temporary directory, so
+DB_PATH is set before app/trail_db are imported.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+WORDS = ("union trail wagon river frontier harvest kindness neighbor bridge town "
+         "prairie letter journey mountain family cheer story morning lantern road").split()
+LOCATIONS = ["usa", "canada", "uk", "france", "brazil", "australia", "miami lakes, fl"]
+# Must not be imported just by booting a web worker (`import app`)
+HEAVY_MODULES = ("tkinter", "pygame", "PIL", "folium", "stripe")
+
+def subscribed_user(i):
+    # Every other user, so route benchmarks can pick accepted or rejected submitters
+    return 1 if i % 2 == 0 else 0
+
+def seed(users, stories, cheers, locations, story_words, seed_value):
+    """Fill a fresh database with synthetic users, stories and cheers."""
+    from trail_db import init_db
+    from trail_conn import get_connection
+    from trail_geo import backfill_story_coordinates
+    from trail_leaderboard import rebuild_leaderboard
+    from trail_bodies import migrate_story_bodies
+    rng = random.Random(seed_value)
+    init_db()
+    month = datetime.now().strftime("%Y-%m")
+    places = (LOCATIONS + [f"town {i}" for i in range(max(0, locations - len(LOCATIONS)))])[:locations]
+    with get_connection() as conn:
+        conn.executemany("INSERT INTO users (username, subscribed, email) VALUES (?, ?, ?)",
+                         [(f"user{i}", subscribed_user(i), f"user{i}@example.com") for i in range(users)])
+        rows = []
+        for i in range(stories):
+            body = " ".join(rng.choice(WORDS) for _ in range(rng.randint(story_words // 4, story_words)))
+            rows.append((rng.randint(1, users), f"Story {i}", body, datetime.now().isoformat(), month,
+                         rng.choice(places) if places else None))
+        conn.executemany("INSERT INTO stories (user_id, title, story, cheers, submitted_at, month, draft, location) VALUES (?, ?, ?, 0, ?, ?, 0, ?)", rows)
+        pairs = {(rng.randint(1, stories), rng.randint(1, users)) for _ in range(cheers)}
+        conn.executemany("INSERT OR IGNORE INTO cheers (story_id, user_id) VALUES (?, ?)", list(pairs))
+        conn.execute("UPDATE stories SET cheers = (SELECT COUNT(*) FROM cheers WHERE cheers.story_id = stories.id)")
+        backfill_story_coordinates(conn.cursor())
+        migrate_story_bodies(conn.cursor())
+    rebuild_leaderboard()
+
+def measure(func, iterations):
+    samples = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - t) * 1000)
+    elapsed = time.perf_counter() - start
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 3),
+        "throughput_rps": round(iterations / elapsed, 1) if elapsed else None,
+    }
+
+def bench_routes(app, users, stories, iterations):
+    client = app.test_client()
+
+    def as_user(i):
+        with client.session_transaction() as s:
+            s["username"] = f"user{i % users}"
+            s["user_id"] = i % users + 1
+
+    def check(response, expect=None):
+        if response.status_code >= 500 or (expect and response.status_code != expect):
+            raise RuntimeError(f"{response.request.path} returned {response.status_code}")
+
+    # Submitters cycle through one kind of user; with --users >= 2 * --iterations
+    # nobody reaches the daily quota or the submit rate limit
+    submitters = {kind: [u for u in range(users) if subscribed_user(u) == kind] for kind in (0, 1)}
+
+    def submit(i, subscribed):
+        pool = submitters[subscribed]
+        as_user(pool[i % len(pool)])
+        response = client.post("/submit", data={"title": f"Bench {i}", "story": "A short benchmark story.", "location": "usa"})
+        # Accepted submissions redirect to /stories; rejections re-render the form
+        check(response, expect=302 if subscribed else 200)
+
+    routes = {
+        "GET /": lambda i: check(client.get("/")),
+        "GET /stories": lambda i: check(client.get("/stories")),
+        "GET /story/<id>": lambda i: check(client.get(f"/story/{i % stories + 1}")),
+        "GET /map": lambda i: check(client.get("/map")),
+        "GET /leaderboard": lambda i: check(client.get("/leaderboard")),
+        "GET /winner": lambda i: check(client.get("/winner")),
+        "POST /cheer": lambda i: (as_user(i), check(client.post(f"/cheer/{i % stories + 1}"))),
+        "POST /submit": lambda i: submit(i, 1),
+        "POST /submit unsubscribed": lambda i: submit(i, 0),
+    }
+    return {name: measure(func, iterations) for name, func in routes.items()}
+
+def bench_db(users, stories, iterations):
+    import trail_db
+    calls = {
+        "get_prize_pool": lambda i: trail_db.get_prize_pool(),
+        "get_random_story_snippet": lambda i: trail_db.get_random_story_snippet(),
+        "get_user_subscription": lambda i: trail_db.get_user_subscription(f"user{i % users}"),
+        "get_existing_users": lambda i: trail_db.get_existing_users(),
+        "get_user_email": lambda i: trail_db.get_user_email(f"user{i % users}"),
+        "view_stories_page": lambda i: trail_db.view_stories_page(),
+        "get_story": lambda i: trail_db.get_story(i % stories + 1),
+        "view_archived_stories": lambda i: trail_db.view_archived_stories(),
+        "get_leaderboard": lambda i: trail_db.get_leaderboard(),
+        "get_map_markers": lambda i: trail_db.get_map_markers(),
+        "get_winner_info": lambda i: trail_db.get_winner_info(),
+        "cheer_story": lambda i: trail_db.cheer_story(f"user{i % users}", i % stories + 1),
+        "flush_cheers": lambda i: trail_db.flush_cheers(),
+        "submit_story": lambda i: trail_db.submit_story(f"user{i % users}", f"Bench {i}", "A short benchmark story.", draft=True),
+    }
+    return {name: measure(func, iterations) for name, func in calls.items()}
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Return the entries whose p50 grew by more than tolerance (a fraction) and min_delta_ms."""
+    regressions = []
+    for group, entries in results.items():
+        for name, stats in entries.items():
+            old = baseline.get(group, {}).get(name)
+            if (old and stats["p50_ms"] > old["p50_ms"] * (1 + tolerance)
+                    and stats["p50_ms"] - old["p50_ms"] > min_delta_ms):
+                regressions.append(f"{group} {name}: p50 {old['p50_ms']}ms -> {stats['p50_ms']}ms")
+    return regressions
+
+def import_report(budget_ms, top=10):
+    """Boot `import app` under -X importtime in a fresh interpreter and check it against the budget.
+
+    Returns (cumulative_ms, heavy_modules_loaded, slowest) where slowest is a
+    list of (cumulative_ms, module) for the top-level imports.
+    """
+    env = dict(os.environ, DB_PATH=os.path.join(tempfile.mkdtemp(prefix="union-import-"), "import.db"))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                          cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import app failed:\n{proc.stderr[-2000:]}")
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((int(cumulative) / 1000, name.rstrip()))
+    total_ms = next((ms for ms, name in modules if name.strip() == "app"), sum(ms for ms, name in modules if not name.startswith("  ")))
+    heavy = sorted({name.strip().split(".")[0] for _, name in modules} & set(HEAVY_MODULES))
+    # Nesting is shown as two extra spaces per level; keep top-level imports and their direct children
+    slowest = sorted(((ms, name.strip()) for ms, name in modules if len(name) - len(name.lstrip()) <= 3), reverse=True)[:top]
+    return total_ms, heavy, slowest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the union app routes and trail_db queries")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--stories", type=int, default=5000)
+    parser.add_argument("--cheers", type=int, default=20000)
+    parser.add_argument("--locations", type=int, default=50)
+    parser.add_argument("--story-words", type=int, default=500)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--min-delta-ms", type=float, default=0.05, help="ignore p50 changes smaller than this")
+    parser.add_argument("--import-report", action="store_true", help="only measure web worker import time")
+    parser.add_argument("--import-budget-ms", type=float, default=1000)
+    args = parser.parse_args(argv)
+
+    if args.import_report:
+        total_ms, heavy, slowest = import_report(args.import_budget_ms)
+        for ms, name in slowest:
+            print(f"  {name:40} {ms:9.1f}ms")
+        print(f"\nimport app: {total_ms:.1f}ms (budget {args.import_budget_ms:.0f}ms)")
+        if heavy:
+            print(f"FAIL heavy modules loaded at boot: {', '.join(heavy)}")
+        if total_ms > args.import_budget_ms:
+            print("FAIL import time over budget")
+        return 1 if heavy or total_ms > args.import_budget_ms else 0
+
+    workdir = tempfile.mkdtemp(prefix="union-bench-")
+    os.environ["DB_PATH"] = os.path.join(workdir, "bench.db")
+    import logging
+    # The unsubscribed /submit runs are rejected on purpose; keep their error log out of the report
+    logging.disable(logging.ERROR)
+
+    t = time.perf_counter()
+    seed(args.users, args.stories, args.cheers, args.locations, args.story_words, args.seed)
+    print(f"Seeded {args.users} users, {args.stories} stories, {args.cheers} cheers in {time.perf_counter() - t:.1f}s")
+
+    from app import app
+    from trail_winners import close_month
+    close_month()
+    results = {
+        "routes": bench_routes(app, args.users, args.stories, args.iterations),
+        "trail_db": bench_db(args.users, args.stories, args.iterations),
+    }
+    for group, entries in results.items():
+        print(f"\n{group}")
+        for name, stats in entries.items():
+            print(f"  {name:28} p50 {stats['p50_ms']:9.3f}ms  p99 {stats['p99_ms']:9.3f}ms  {stats['throughput_rps']} req/s")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"params": vars(args), **results}, f, indent=2, default=str)
+        print(f"\nBaseline saved to {args.baseline}")
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"\nNo baseline at {args.baseline}")
+            return 2
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        params = {k: v for k, v in vars(args).items() if k in ("users", "stories", "cheers", "locations", "story_words", "iterations")}
+        if any(baseline.get("params", {}).get(k) != v for k, v in params.items()):
+            print("WARNING baseline was recorded with different seed parameters")
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        print(f"\n{len(regressions)} regressions beyond {args.tolerance:.0%}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import zlib
+import logging
+
+EXCERPT_WORDS = 60
+COMPRESS_LEVEL = 6
+MIGRATE_BATCH = 500
+
+# Full story text lives zlib-compressed in a side table keyed by the row id,
+# so list queries over stories/archived_stories only touch the short excerpt.
+BODY_TABLES = {"stories": "story_bodies", "archived_stories": "archived_story_bodies"}
+
+def compress_story(text):
+    return zlib.compress(text.encode("utf-8"), COMPRESS_LEVEL)
+
+def decompress_story(blob):
+    return None if blob is None else zlib.decompress(blob).decode("utf-8")
+
+def make_excerpt(text):
+    words = text.split(None, EXCERPT_WORDS)
+    if len(words) > EXCERPT_WORDS:
+        return " ".join(words[:EXCERPT_WORDS]) + " ..."
+    return " ".join(words)
+
+def register_functions(conn):
+    """Expose story_text(body) to SQL for queries on pooled connections (e.g. the exporter)."""
+    conn.create_function("story_text", 1, decompress_story, deterministic=True)
+
+def init_bodies(c):
+    """Create the body tables; called from init_db inside its transaction."""
+    for table, bodies in BODY_TABLES.items():
+        c.execute(f"CREATE TABLE IF NOT EXISTS {bodies} (story_id INTEGER PRIMARY KEY, body BLOB NOT NULL)")
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS {bodies}_delete AFTER DELETE ON {table} BEGIN
+                          DELETE FROM {bodies} WHERE story_id = old.id;
+                      END''')
+
+def save_body(c, table, story_id, text, overwrite=True):
+    """Store a story's compressed body and refresh its excerpt, word count and search entry.
+
+    With overwrite=False an existing body is left alone (used by bulk import).
+    """
+    conflict = "DO UPDATE SET body = excluded.body" if overwrite else "DO NOTHING"
+    c.execute(f"INSERT INTO {BODY_TABLES[table]} (story_id, body) VALUES (?, ?) ON CONFLICT (story_id) {conflict}",
+              (story_id, compress_story(text)))
+    if c.rowcount:
+        c.execute(f"UPDATE {table} SET excerpt = ?, word_count = ? WHERE id = ?",
+                  (make_excerpt(text), len(text.split()), story_id))
+        # Imported here: trail_search depends on this module
+        from trail_search import index_body
+        index_body(c, table, story_id, text)
+
+def get_body(c, table, story_id):
+    c.execute(f"SELECT body FROM {BODY_TABLES[table]} WHERE story_id = ?", (story_id,))
+    row = c.fetchone()
+    return decompress_story(row[0]) if row else None
+
+def migrate_story_bodies(c):
+    """Move bodies still stored inline in the story column into the compressed tables."""
+    moved = 0
+    for table in BODY_TABLES:
+        while True:
+            c.execute(f"SELECT id, story FROM {table} WHERE story IS NOT NULL LIMIT ?", (MIGRATE_BATCH,))
+            rows = c.fetchall()
+            if not rows:
+                break
+            for story_id, text in rows:
+                save_body(c, table, story_id, text)
+            c.executemany(f"UPDATE {table} SET story = NULL WHERE id = ?", [(story_id,) for story_id, _ in rows])
+            moved += len(rows)
+    if moved:
+        logging.info(f"Moved {moved} story bodies to compressed storage")
+    return moved
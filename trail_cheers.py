@@ -0,0 +1,166 @@
+import sqlite3
+import threading
+import atexit
+import glob
+import os
+import logging
+from datetime import datetime
+from trail_conn import get_connection
+from trail_leaderboard import adjust_story
+from trail_versions import bump_version
+
+CHEER_FLUSH_INTERVAL = float(os.environ.get("CHEER_FLUSH_INTERVAL", 2.0))
+CHEER_FLUSH_SIZE = int(os.environ.get("CHEER_FLUSH_SIZE", 100))
+# When set, pending cheers are appended to <CHEER_LOG_PATH>.<pid> until flushed
+CHEER_LOG_PATH = os.environ.get("CHEER_LOG_PATH")
+
+def init_cheers(c):
+    """Create the per-user cheer table; called from init_db inside its transaction."""
+    c.execute('''CREATE TABLE IF NOT EXISTS cheers
+                 (story_id INTEGER NOT NULL, user_id INTEGER NOT NULL, cheered_at TEXT,
+                  PRIMARY KEY (story_id, user_id))''')
+
+def apply_cheers(pairs):
+    """Apply (username, story_id) cheers in one transaction and return {story_id: applied}.
+
+    The cheers primary key makes this idempotent: a user's repeat cheer, or
+    a replayed log entry, is ignored and does not bump stories.cheers.
+    """
+    applied = {}
+    now = datetime.now().isoformat()
+    with get_connection() as conn:
+        c = conn.cursor()
+        for username, story_id in pairs:
+            c.execute("INSERT OR IGNORE INTO cheers (story_id, user_id, cheered_at) SELECT ?, u.id, ? FROM users u WHERE u.username = ? AND EXISTS (SELECT 1 FROM stories WHERE id = ?)",
+                      (story_id, now, username, story_id))
+            if c.rowcount > 0:
+                applied[story_id] = applied.get(story_id, 0) + 1
+        c.executemany("UPDATE stories SET cheers = cheers + ? WHERE id = ?",
+                      [(count, story_id) for story_id, count in applied.items()])
+        for story_id, count in applied.items():
+            adjust_story(c, story_id, cheers=count)
+        if applied:
+            bump_version(c)
+    return applied
+
+class CheerBuffer:
+    """Collects cheers in memory and writes them in batches.
+
+    Pending cheers are keyed by story_id with the set of usernames that
+    cheered it, so duplicates inside one batch collapse for free. A batch is
+    written when CHEER_FLUSH_SIZE cheers are pending or every
+    CHEER_FLUSH_INTERVAL seconds, whichever comes first.
+    """
+
+    def __init__(self, flush_interval=CHEER_FLUSH_INTERVAL, flush_size=CHEER_FLUSH_SIZE, log_path=CHEER_LOG_PATH):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.log_path = log_path
+        self._pending = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._log = None
+        self._pid = None
+        self._wakeup = threading.Event()
+
+    def _log_file(self):
+        return f"{self.log_path}.{os.getpid()}"
+
+    def _ensure_started(self):
+        # Started lazily so each gunicorn worker gets its own flusher thread
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._pending = {}
+        self._count = 0
+        self._log = open(self._log_file(), "a", encoding="utf-8") if self.log_path else None
+        threading.Thread(target=self._run, name="cheer-flusher", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def add(self, username, story_id):
+        with self._lock:
+            self._ensure_started()
+            users = self._pending.setdefault(story_id, set())
+            if username in users:
+                return False
+            users.add(username)
+            self._count += 1
+            if self._log:
+                self._log.write(f"{story_id}\t{username}\n")
+                self._log.flush()
+            if self._count >= self.flush_size:
+                self._wakeup.set()
+            return True
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._count:
+                    return {}
+                pending, self._pending, self._count = self._pending, {}, 0
+            pairs = [(username, story_id) for story_id, users in pending.items() for username in users]
+            try:
+                applied = apply_cheers(pairs)
+            except sqlite3.Error as e:
+                logging.error(f"Cheer flush failed, will retry: {e}")
+                with self._lock:
+                    for username, story_id in pairs:
+                        if username not in self._pending.setdefault(story_id, set()):
+                            self._pending[story_id].add(username)
+                            self._count += 1
+                return {}
+            with self._lock:
+                if self._log:
+                    # Keep only what is still pending; flushed entries are durable now
+                    self._log.close()
+                    self._log = open(self._log_file(), "w", encoding="utf-8")
+                    for story_id, users in self._pending.items():
+                        for username in users:
+                            self._log.write(f"{story_id}\t{username}\n")
+                    self._log.flush()
+            logging.info(f"Flushed {len(pairs)} cheers, applied {sum(applied.values())}")
+            return applied
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def replay_cheer_logs(log_path=CHEER_LOG_PATH):
+    """Re-apply cheers left in append logs by crashed workers; safe to run more than once."""
+    if not log_path:
+        return 0
+    replayed = 0
+    for path in glob.glob(f"{log_path}.*"):
+        pid = path.rsplit(".", 1)[-1]
+        if not pid.isdigit() or (int(pid) != os.getpid() and _pid_alive(int(pid))):
+            continue
+        try:
+            with open(path, encoding="utf-8") as f:
+                pairs = []
+                for line in f:
+                    story_id, _, username = line.rstrip("\n").partition("\t")
+                    if story_id.isdigit() and username:
+                        pairs.append((username, int(story_id)))
+            apply_cheers(pairs)
+            if int(pid) != os.getpid():
+                os.remove(path)
+            replayed += len(pairs)
+        except (OSError, sqlite3.Error) as e:
+            logging.error(f"Replay cheer log {path} failed: {e}")
+    if replayed:
+        logging.info(f"Replayed {replayed} cheers from {log_path}")
+    return replayed
+
+cheer_buffer = CheerBuffer()
+atexit.register(cheer_buffer.flush)
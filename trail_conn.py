@@ -0,0 +1,59 @@
+import sqlite3
+import threading
+import os
+import logging
+from trail_metrics import InstrumentedConnection
+from trail_bodies import register_functions
+
+DEFAULT_DB_PATH = "/tmp/union_app.db"
+BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", 5000))
+CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", 16384))
+SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL")
+
+_local = threading.local()
+
+def get_db_path():
+    return os.environ.get("DB_PATH", DEFAULT_DB_PATH)
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000, factory=InstrumentedConnection)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA synchronous = {SYNCHRONOUS}")
+    # Negative cache_size is in KiB rather than pages
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    register_functions(conn)
+    logging.debug(f"Opened pooled connection to {db_path} (pid {os.getpid()}, thread {threading.get_ident()})")
+    return conn
+
+def configure_db():
+    """Switch the database to WAL once at startup; the journal mode is stored in the file."""
+    conn = get_connection()
+    mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+    logging.info(f"Database {get_db_path()} journal mode: {mode}")
+    return mode
+
+def get_connection(db_path=None):
+    """Return this thread's connection for db_path (default DB_PATH), opening it on first use.
+
+    Connections are never shared across threads, and the pool is reset after a
+    fork so gunicorn workers don't inherit the master's connections.
+    """
+    db_path = db_path or get_db_path()
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.conns = {}
+    conn = _local.conns.get(db_path)
+    if conn is None:
+        conn = _connect(db_path)
+        _local.conns[db_path] = conn
+    return conn
+
+def close_connections():
+    conns = getattr(_local, "conns", None) or {}
+    for conn in conns.values():
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Close connection failed: {e}")
+    _local.conns = {}
@@ -1,35 +1,108 @@
 import sqlite3
-from datetime import datetime, timedelta
-import re
+from datetime import datetime
 import random
-import os
 import logging
+import threading
+import time
+from trail_conn import get_connection, get_db_path, configure_db
+from trail_logging import configure_logging
+from trail_metrics import instrument_db, init_metrics
+from trail_cache import TTLCache
+from trail_geo import init_locations, load_gazetteer, resolve_location, backfill_story_coordinates
+from trail_cheers import init_cheers, replay_cheer_logs, cheer_buffer
+from trail_leaderboard import init_leaderboard, adjust_story, rebuild_leaderboard, get_leaderboard
+from trail_winners import init_winners, close_month, get_winner_info
+from trail_search import init_search, search_stories
+from trail_bodies import init_bodies, save_body, get_body, migrate_story_bodies
+from trail_versions import init_versions, bump_version, get_data_version
+from trail_ratelimit import init_ratelimit, take_daily_quota
+from trail_jobs import init_jobs
+from trail_validation import MAX_STORY_WORDS, check_username, check_email, check_submission
 
 MAX_STORIES_PER_DAY = 3
-MAX_STORY_WORDS = 20000
+STORIES_PAGE_SIZE = 20
+AGGREGATE_CACHE_TTL = 30
+SNIPPET_POOL_SIZE = 50
+SNIPPET_POOL_TTL = 300
 ADMIN_USERNAME = "admin"
 
-logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
+configure_logging()
+
+# Re-exported from their subsystem modules, instrumented under trail_db's name
+get_leaderboard = instrument_db(get_leaderboard)
+get_winner_info = instrument_db(get_winner_info)
+close_month = instrument_db(close_month)
+search_stories = instrument_db(search_stories)
+get_data_version = instrument_db(get_data_version)
+
+# Home-page aggregates: prize pool and per-user subscription state
+_aggregate_cache = TTLCache(maxsize=4096, ttl=AGGREGATE_CACHE_TTL)
+
+_snippet_pool = []
+_snippet_pool_expires = 0
+_snippet_pool_refreshing = False
+_snippet_pool_lock = threading.Lock()
+
+def _ensure_column(c, table, column, decl):
+    c.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in c.fetchall()]:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+        logging.info(f"Added column {table}.{column}")
 
 def init_db():
-    db_path = os.environ.get("DB_PATH", "/tmp/union_app.db")
+    db_path = get_db_path()
     logging.info(f"Attempting to initialize database at {db_path}")
     try:
-        with sqlite3.connect(db_path) as conn:
+        configure_db()
+        with get_connection() as conn:
             c = conn.cursor()
             c.execute('''CREATE TABLE IF NOT EXISTS users 
                          (id INTEGER PRIMARY KEY, username TEXT UNIQUE, subscribed INTEGER DEFAULT 0, 
-                          avatar_path TEXT, email TEXT UNIQUE)''')
+                          avatar_path TEXT, email TEXT UNIQUE, stripe_customer_id TEXT)''')
+            _ensure_column(c, "users", "stripe_customer_id", "TEXT")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_users_stripe_customer ON users (stripe_customer_id)")
+            # One reusable Stripe Payment Link per price, shared by all workers
+            c.execute('''CREATE TABLE IF NOT EXISTS payment_links
+                         (price_id TEXT PRIMARY KEY, url TEXT NOT NULL, created_at TEXT)''')
             c.execute('''CREATE TABLE IF NOT EXISTS stories 
                          (id INTEGER PRIMARY KEY, user_id INTEGER, title TEXT, story TEXT, 
                           cheers INTEGER DEFAULT 0, submitted_at TEXT, month TEXT, image_path TEXT, 
-                          draft INTEGER DEFAULT 0, location TEXT)''')
+                          draft INTEGER DEFAULT 0, location TEXT, lat REAL, lon REAL, excerpt TEXT, word_count INTEGER)''')
+            _ensure_column(c, "stories", "lat", "REAL")
+            _ensure_column(c, "stories", "lon", "REAL")
             c.execute('''CREATE TABLE IF NOT EXISTS comments 
                          (id INTEGER PRIMARY KEY, story_id INTEGER, user_id INTEGER, comment TEXT, created_at TEXT)''')
             c.execute('''CREATE TABLE IF NOT EXISTS archived_stories 
                          (id INTEGER PRIMARY KEY, user_id INTEGER, title TEXT, story TEXT, 
-                          cheers INTEGER, month TEXT, image_path TEXT, archived_at TEXT, location TEXT)''')
+                          cheers INTEGER, month TEXT, image_path TEXT, archived_at TEXT, location TEXT,
+                          excerpt TEXT, word_count INTEGER)''')
+            # The story column is legacy: bodies are kept compressed by trail_bodies
+            for table in ("stories", "archived_stories"):
+                _ensure_column(c, table, "excerpt", "TEXT")
+                _ensure_column(c, table, "word_count", "INTEGER")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_stories_draft_id ON stories (draft, id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_stories_user_submitted ON stories (user_id, submitted_at)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_stories_month_draft_cheers ON stories (month, draft, cheers)")
+            init_locations(c)
+            init_cheers(c)
+            init_leaderboard(c)
+            init_winners(c)
+            init_bodies(c)
+            init_versions(c)
+            init_ratelimit(c)
+            init_jobs(c)
+            init_metrics(c)
+            init_search(c)
+            migrate_story_bodies(c)
+            conn.commit()
+            load_gazetteer()
+            backfill_story_coordinates(c)
             conn.commit()
+            c.execute("SELECT EXISTS (SELECT 1 FROM user_totals), EXISTS (SELECT 1 FROM stories WHERE draft = 0)")
+            has_totals, has_stories = c.fetchone()
+            if has_stories and not has_totals:
+                rebuild_leaderboard()
+            replay_cheer_logs()
             logging.info(f"Database initialized successfully at {db_path}")
             c.execute("SELECT name FROM sqlite_master WHERE type='table'")
             tables = c.fetchall()
@@ -37,19 +110,20 @@ def init_db():
     except sqlite3.Error as e:
         logging.error(f"Database init failed: {e}")
 
+@instrument_db
 def register_user(username, email, avatar_path=None):
-    db_path = os.environ.get("DB_PATH", "/tmp/union_app.db")
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
-            if not re.match(r"^[a-zA-Z0-9_]+$", username):
+            if not check_username(username).valid:
                 return "Username must be alphanumeric / Nombre de usuario debe ser alfanumérico"
-            if not re.match(r"[^@]+@[^@]+\.[^@]+", email):
+            if not check_email(email).valid:
                 return "Invalid email format / Formato de correo inválido"
             try:
                 c.execute("INSERT INTO users (username, subscribed, avatar_path, email) VALUES (?, 0, ?, ?)", 
                           (username, avatar_path, email))
                 conn.commit()
+                _aggregate_cache.invalidate(("subscribed", username))
                 logging.info(f"User {username} registered")
                 return f"Welcome, {username}! / ¡Bienvenido, {username}!"
             except sqlite3.IntegrityError:
@@ -58,62 +132,182 @@ def register_user(username, email, avatar_path=None):
         logging.error(f"Register user failed: {e}")
         return "Database error / Error de base de datos"
 
+@instrument_db
+def login_or_register(username, email=None):
+    """Look up a user by the unique username index, registering them if new.
+
+    Returns (user_id, subscribed, None), or (None, False, error message).
+    Existing users cost one indexed read; new users one insert on top.
+    """
+    email = email or f"{username}@example.com"
+    if not check_username(username).valid:
+        return None, False, "Username must be alphanumeric / Nombre de usuario debe ser alfanumérico"
+    try:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT id, subscribed FROM users WHERE username = ?", (username,))
+            user = c.fetchone()
+            if user:
+                return user[0], bool(user[1]), None
+            if not check_email(email).valid:
+                return None, False, "Invalid email format / Formato de correo inválido"
+            try:
+                c.execute("INSERT INTO users (username, subscribed, email) VALUES (?, 0, ?) ON CONFLICT (username) DO NOTHING RETURNING id, subscribed",
+                          (username, email))
+                user = c.fetchone()
+            except sqlite3.IntegrityError:
+                return None, False, "Username or email already taken / Nombre de usuario o correo ya tomados"
+            if not user:
+                # Registered by a concurrent request between the lookup and the insert
+                c.execute("SELECT id, subscribed FROM users WHERE username = ?", (username,))
+                user = c.fetchone()
+            else:
+                _aggregate_cache.invalidate(("subscribed", username))
+                logging.info(f"User {username} registered")
+            return user[0], bool(user[1]), None
+    except sqlite3.Error as e:
+        logging.error(f"Login or register failed: {e}")
+        return None, False, "Database error / Error de base de datos"
+
+@instrument_db
 def subscribe_user(username):
-    db_path = os.environ.get("DB_PATH", "/tmp/union_app.db")
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
             c.execute("UPDATE users SET subscribed = 1 WHERE username = ?", (username,))
+            bump_version(c)
             conn.commit()
+            _aggregate_cache.invalidate(("subscribed", username))
+            _aggregate_cache.invalidate("prize_pool")
             logging.info(f"User {username} subscribed")
             return f"{username}, you're now subscribed / {username}, ahora estás suscrito"
     except sqlite3.Error as e:
         logging.error(f"Subscribe user failed: {e}")
         return "Database error / Error de base de datos"
 
+@instrument_db
+def apply_subscription_changes(changes):
+    """Apply (username, stripe_customer_id, subscribed) changes in order, in one transaction.
+
+    Changes with no username are matched by Stripe customer id, which is
+    recorded on the user when their checkout completes. Returns rows updated.
+    """
+    updated = 0
+    usernames = set()
+    try:
+        with get_connection() as conn:
+            c = conn.cursor()
+            for username, customer_id, subscribed in changes:
+                if username:
+                    c.execute("UPDATE users SET subscribed = ?, stripe_customer_id = COALESCE(?, stripe_customer_id) WHERE username = ? RETURNING username",
+                              (1 if subscribed else 0, customer_id, username))
+                else:
+                    c.execute("UPDATE users SET subscribed = ? WHERE stripe_customer_id = ? RETURNING username",
+                              (1 if subscribed else 0, customer_id))
+                # Returned names let the cached subscription flags be dropped for customer-id matches too
+                matched = [row[0] for row in c.fetchall()]
+                usernames.update(matched)
+                updated += len(matched)
+            if updated:
+                bump_version(c)
+    except sqlite3.Error as e:
+        logging.error(f"Apply subscription changes failed: {e}")
+        raise
+    for username in usernames:
+        _aggregate_cache.invalidate(("subscribed", username))
+    _aggregate_cache.invalidate("prize_pool")
+    logging.info(f"Applied {len(changes)} subscription changes, {updated} users updated")
+    return updated
+
+@instrument_db
+def get_payment_link(price_id):
+    try:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT url FROM payment_links WHERE price_id = ?", (price_id,))
+            row = c.fetchone()
+            return row[0] if row else None
+    except sqlite3.Error as e:
+        logging.error(f"Get payment link failed: {e}")
+        return None
+
+@instrument_db
+def save_payment_link(price_id, url):
+    """Store a price's Payment Link; the first one saved wins if two workers race."""
+    try:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("INSERT INTO payment_links (price_id, url, created_at) VALUES (?, ?, ?) ON CONFLICT (price_id) DO NOTHING",
+                      (price_id, url, datetime.now().isoformat()))
+            c.execute("SELECT url FROM payment_links WHERE price_id = ?", (price_id,))
+            return c.fetchone()[0]
+    except sqlite3.Error as e:
+        logging.error(f"Save payment link failed: {e}")
+        return url
+
+@instrument_db
 def get_user_subscription(username):
-    db_path = os.environ.get("DB_PATH", "/tmp/union_app.db")
+    subscribed = _aggregate_cache.get(("subscribed", username))
+    if subscribed is not None:
+        return subscribed
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
             c.execute("SELECT subscribed FROM users WHERE username = ?", (username,))
             result = c.fetchone()
             subscribed = result[0] if result else False
+            _aggregate_cache.set(("subscribed", username), subscribed)
             logging.info(f"Subscription status for {username}: {subscribed}")
             return subscribed
     except sqlite3.Error as e:
         logging.error(f"Get user subscription failed: {e}")
         return False
 
-def submit_story(username, title, story, image_path=None, story_id=None, draft=False, location=None):
-    db_path = os.environ.get("DB_PATH", "/tmp/union_app.db")
+@instrument_db
+def submit_story(username, title, story, image_path=None, story_id=None, draft=False, location=None, validation=None):
+    """Save or update a story; pass validation=check_submission(title, story) to skip re-validating."""
+    db_path = get_db_path()
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
             c.execute("SELECT id, subscribed FROM users WHERE username = ?", (username,))
             user = c.fetchone()
             if not user:
                 return "User not found / Usuario no encontrado"
             if user[1] == 1 or draft:
-                if not re.match(r"^[a-zA-Z0-9\s.,!?]+$", title):
+                validation = validation or check_submission(title, story)
+                if validation.field == "title":
                     return "Invalid title characters / Caracteres de título inválidos"
-                if not re.match(r"^[a-zA-Z0-9\s.,!?*]+$", story):
-                    return "Invalid story characters / Caracteres de historia inválidos"
-                if len(story.split()) > MAX_STORY_WORDS:
+                if validation.reason in ("too_long", "too_many_words"):
                     return f"Story exceeds {MAX_STORY_WORDS} words / Historia excede {MAX_STORY_WORDS} palabras"
+                if not validation.valid:
+                    return "Invalid story characters / Caracteres de historia inválidos"
+                lat, lon = resolve_location(c, location)
                 if story_id:
-                    c.execute("UPDATE stories SET title = ?, story = ?, image_path = ?, submitted_at = ?, draft = ?, location = ? WHERE id = ? AND user_id = ?", 
-                              (title, story, image_path, datetime.now().isoformat(), 1 if draft else 0, location, story_id, user[0]))
+                    c.execute("SELECT draft FROM stories WHERE id = ? AND user_id = ?", (story_id, user[0]))
+                    previous = c.fetchone()
+                    if previous and previous[0] == 0:
+                        adjust_story(c, story_id, -1)
+                    c.execute("UPDATE stories SET title = ?, image_path = ?, submitted_at = ?, draft = ?, location = ?, lat = ?, lon = ? WHERE id = ? AND user_id = ?", 
+                              (title, image_path, datetime.now().isoformat(), 1 if draft else 0, location, lat, lon, story_id, user[0]))
+                    if c.rowcount:
+                        save_body(c, "stories", story_id, story)
+                        adjust_story(c, story_id)
                 else:
                     if not draft:
-                        c.execute("SELECT COUNT(*) FROM stories WHERE user_id = ? AND submitted_at > ? AND draft = 0", 
-                                  (user[0], (datetime.now() - timedelta(days=1)).isoformat()))
-                        if c.fetchone()[0] >= MAX_STORIES_PER_DAY:
+                        if not take_daily_quota(c, user[0], MAX_STORIES_PER_DAY):
                             return "Story limit reached for today / Límite de historias alcanzado por hoy"
                     month = datetime.now().strftime("%Y-%m") if not draft else None
-                    c.execute("INSERT INTO stories (user_id, title, story, cheers, submitted_at, month, image_path, draft, location) VALUES (?, ?, ?, 0, ?, ?, ?, ?, ?)", 
-                              (user[0], title, story, datetime.now().isoformat(), month, image_path, 1 if draft else 0, location))
+                    c.execute("INSERT INTO stories (user_id, title, cheers, submitted_at, month, image_path, draft, location, lat, lon) VALUES (?, ?, 0, ?, ?, ?, ?, ?, ?, ?)", 
+                              (user[0], title, datetime.now().isoformat(), month, image_path, 1 if draft else 0, location, lat, lon))
+                    new_id = c.lastrowid
+                    save_body(c, "stories", new_id, story)
+                    adjust_story(c, new_id)
+                bump_version(c)
+                bump_version(c, "stories")
                 conn.commit()
+                if not draft:
+                    invalidate_snippet_pool()
                 logging.info(f"Story saved to {db_path}: {title}")
                 return "Draft saved successfully / Borrador guardado con éxito" if draft else "Story submitted successfully / Historia enviada con éxito"
             return "You need to subscribe first / Necesitas suscribirte primero"
@@ -121,12 +315,13 @@ def submit_story(username, title, story, image_path=None, story_id=None, draft=F
         logging.error(f"Submit story failed: {e}")
         return "Database error / Error de base de datos"
 
+@instrument_db
 def view_stories():
-    db_path = os.environ.get("DB_PATH", "/tmp/union_app.db")
+    db_path = get_db_path()
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
-            c.execute("SELECT s.id, s.title, s.story, s.cheers, u.username, s.user_id, s.image_path, s.location FROM stories s LEFT JOIN users u ON s.user_id = u.id WHERE s.draft = 0 ORDER BY s.id DESC")
+            c.execute("SELECT s.id, s.title, s.excerpt, s.cheers, u.username, s.user_id, s.image_path, s.location, s.word_count FROM stories s LEFT JOIN users u ON s.user_id = u.id WHERE s.draft = 0 ORDER BY s.id DESC")
             stories = c.fetchall()
             logging.info(f"Fetched {len(stories)} stories from {db_path}")
             return stories
@@ -134,25 +329,85 @@ def view_stories():
         logging.error(f"View stories failed: {e}")
         return []
 
-def cheer_story(username, story_id):
-    db_path = os.environ.get("DB_PATH", "/tmp/union_app.db")
+@instrument_db
+def view_stories_page(before_id=None, limit=STORIES_PAGE_SIZE):
+    """Return one page of the feed, newest first, and the cursor for the next page (None on the last page)."""
+    db_path = get_db_path()
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
-            c.execute("UPDATE stories SET cheers = cheers + 1 WHERE id = ?", (story_id,))
-            conn.commit()
-            logging.info(f"Story #{story_id} cheered by {username}")
-            return f"Cheered story #{story_id} / Aplaudida historia #{story_id}"
+            query = "SELECT s.id, s.title, s.excerpt, s.cheers, u.username, s.user_id, s.image_path, s.location, s.word_count FROM stories s LEFT JOIN users u ON s.user_id = u.id WHERE s.draft = 0"
+            params = []
+            if before_id is not None:
+                query += " AND s.id < ?"
+                params.append(before_id)
+            query += " ORDER BY s.id DESC LIMIT ?"
+            params.append(limit + 1)
+            c.execute(query, params)
+            stories = c.fetchall()
+            next_cursor = stories[limit - 1][0] if len(stories) > limit else None
+            stories = stories[:limit]
+            logging.info(f"Fetched page of {len(stories)} stories from {db_path} (before={before_id})")
+            return stories, next_cursor
     except sqlite3.Error as e:
-        logging.error(f"Cheer story failed: {e}")
-        return "Database error / Error de base de datos"
+        logging.error(f"View stories page failed: {e}")
+        return [], None
+
+@instrument_db
+def get_story(story_id, archived=False):
+    """Load one published story with its full text for the detail page, or None.
+
+    Returns (id, title, story, cheers, username, image_path, location, month).
+    """
+    table = "archived_stories" if archived else "stories"
+    published = "" if archived else " AND t.draft = 0"
+    try:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute(f"SELECT t.id, t.title, t.cheers, u.username, t.image_path, t.location, t.month FROM {table} t LEFT JOIN users u ON t.user_id = u.id WHERE t.id = ?{published}",
+                      (story_id,))
+            row = c.fetchone()
+            if not row:
+                return None
+            body = get_body(c, table, story_id)
+            logging.info(f"Fetched {table} #{story_id}")
+            return (row[0], row[1], body or "", *row[2:])
+    except sqlite3.Error as e:
+        logging.error(f"Get story failed: {e}")
+        return None
+
+@instrument_db
+def get_map_markers():
+    try:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT s.lat, s.lon, s.title, u.username FROM stories s LEFT JOIN users u ON s.user_id = u.id WHERE s.draft = 0 AND s.lat IS NOT NULL")
+            markers = c.fetchall()
+            logging.info(f"Fetched {len(markers)} map markers")
+            return markers
+    except sqlite3.Error as e:
+        logging.error(f"Get map markers failed: {e}")
+        return []
+
+@instrument_db
+def cheer_story(username, story_id):
+    """Queue a cheer; the buffered count reaches stories.cheers on the next batch flush."""
+    if not cheer_buffer.add(username, story_id):
+        return f"Already cheered story #{story_id} / Ya aplaudiste la historia #{story_id}"
+    logging.info(f"Story #{story_id} cheered by {username}")
+    return f"Cheered story #{story_id} / Aplaudida historia #{story_id}"
 
+@instrument_db
+def flush_cheers():
+    return cheer_buffer.flush()
+
+@instrument_db
 def view_archived_stories():
-    db_path = os.environ.get("DB_PATH", "/tmp/union_app.db")
+    db_path = get_db_path()
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
-            c.execute("SELECT a.id, a.title, a.story, a.cheers, a.month, a.image_path, u.username, a.location FROM archived_stories a JOIN users u ON a.user_id = u.id ORDER BY a.archived_at DESC")
+            c.execute("SELECT a.id, a.title, a.excerpt, a.cheers, a.month, a.image_path, u.username, a.location, a.word_count FROM archived_stories a JOIN users u ON a.user_id = u.id ORDER BY a.archived_at DESC")
             archived = c.fetchall()
             logging.info(f"Fetched {len(archived)} archived stories from {db_path}")
             return archived
@@ -160,50 +415,33 @@ def view_archived_stories():
         logging.error(f"View archived stories failed: {e}")
         return []
 
-def pick_winner():
-    db_path = os.environ.get("DB_PATH", "/tmp/union_app.db")
-    try:
-        with sqlite3.connect(db_path) as conn:
-            c = conn.cursor()
-            month = (datetime.now() - timedelta(days=30)).strftime("%Y-%m")
-            c.execute("SELECT s.id, s.title, s.story, s.cheers, s.user_id, s.image_path, u.username, s.location FROM stories s JOIN users u ON s.user_id = u.id WHERE s.month = ? AND s.draft = 0 ORDER BY s.cheers DESC LIMIT 3", (month,))
-            winners = c.fetchall()
-            if winners:
-                prize_pool = get_prize_pool()
-                total_prize = prize_pool * (2/3)
-                payouts = [total_prize * 0.5, total_prize * 0.3, total_prize * 0.2]
-                result = []
-                for i, (story_id, title, story, cheers, user_id, image_path, username, location) in enumerate(winners):
-                    c.execute("SELECT COUNT(*) FROM archived_stories WHERE id = ? AND month = ?", (story_id, month))
-                    if c.fetchone()[0] == 0:
-                        c.execute("INSERT INTO archived_stories (id, user_id, title, story, cheers, month, image_path, archived_at, location) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", 
-                                  (story_id, user_id, title, story, cheers, month, image_path, datetime.now().isoformat(), location))
-                    result.append(f"#{i+1}: {username} with '{title}' ({cheers} cheers) - ${payouts[i]:.2f} / #{i+1}: {username} con '{title}' ({cheers} aplausos) - ${payouts[i]:.2f}")
-                conn.commit()
-                logging.info(f"Winners picked for {month}: {len(winners)}")
-                return "\n".join(result)
-            return "No stories last month / No hay historias del último mes"
-    except sqlite3.Error as e:
-        logging.error(f"Pick winner failed: {e}")
-        return "Database error / Error de base de datos"
+@instrument_db
+def pick_winner(month=None):
+    """Run the month-close job (a no-op once the month is closed) and return its results."""
+    close_month(month)
+    return get_winner_info(month)
 
+@instrument_db
 def get_prize_pool():
-    db_path = os.environ.get("DB_PATH", "/tmp/union_app.db")
+    prize_pool = _aggregate_cache.get("prize_pool")
+    if prize_pool is not None:
+        return prize_pool
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
             c.execute("SELECT COUNT(*) FROM users WHERE subscribed = 1")
             sub_count = c.fetchone()[0]
+            _aggregate_cache.set("prize_pool", sub_count * 3)
             logging.info(f"Prize pool calculated: {sub_count * 3}")
             return sub_count * 3
     except sqlite3.Error as e:
         logging.error(f"Get prize pool failed: {e}")
         return 0
 
+@instrument_db
 def get_existing_users():
-    db_path = os.environ.get("DB_PATH", "/tmp/union_app.db")
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
             c.execute("SELECT username FROM users")
             users = [row[0] for row in c.fetchall()]
@@ -213,10 +451,10 @@ def get_existing_users():
         logging.error(f"Get existing users failed: {e}")
         return []
 
+@instrument_db
 def get_user_email(username):
-    db_path = os.environ.get("DB_PATH", "/tmp/union_app.db")
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
             c.execute("SELECT email FROM users WHERE username = ?", (username,))
             result = c.fetchone()
@@ -226,38 +464,70 @@ def get_user_email(username):
         logging.error(f"Get user email failed: {e}")
         return None
 
-def get_leaderboard(limit=10):
-    db_path = os.environ.get("DB_PATH", "/tmp/union_app.db")
+def _make_snippet(story):
+    words = story.split()
+    if len(words) > 10:
+        start = random.randint(0, len(words) - 10)
+        return " ".join(words[start:start + 10])
+    return story
+
+@instrument_db
+def refresh_snippet_pool():
+    """Rebuild the quote pool by probing random ids on the (draft, id) index instead of ORDER BY RANDOM()."""
+    global _snippet_pool, _snippet_pool_expires
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
-            c.execute("SELECT u.username, SUM(s.cheers) as total_cheers FROM stories s JOIN users u ON s.user_id = u.id WHERE s.draft = 0 GROUP BY u.id, u.username ORDER BY total_cheers DESC LIMIT ?", (limit,))
-            leaders = c.fetchall()
-            logging.info(f"Fetched leaderboard with {len(leaders)} entries")
-            return leaders
+            c.execute("SELECT MIN(id), MAX(id) FROM stories WHERE draft = 0")
+            low, high = c.fetchone()
+            pool = []
+            if low is not None:
+                seen = set()
+                for _ in range(SNIPPET_POOL_SIZE):
+                    c.execute("SELECT id, excerpt FROM stories WHERE draft = 0 AND id >= ? ORDER BY id LIMIT 1",
+                              (random.randint(low, high),))
+                    row = c.fetchone()
+                    if row and row[0] not in seen:
+                        seen.add(row[0])
+                        pool.append(_make_snippet((row[1] or "").removesuffix(" ...")))
+        with _snippet_pool_lock:
+            _snippet_pool = pool
+            _snippet_pool_expires = time.monotonic() + SNIPPET_POOL_TTL
+        logging.info(f"Snippet pool refreshed with {len(pool)} snippets")
     except sqlite3.Error as e:
-        logging.error(f"Get leaderboard failed: {e}")
-        return []
+        logging.error(f"Refresh snippet pool failed: {e}")
 
+def _refresh_snippet_pool_in_background():
+    global _snippet_pool_refreshing
+    with _snippet_pool_lock:
+        if _snippet_pool_refreshing:
+            return
+        _snippet_pool_refreshing = True
+
+    def run():
+        global _snippet_pool_refreshing
+        try:
+            refresh_snippet_pool()
+        finally:
+            _snippet_pool_refreshing = False
+
+    threading.Thread(target=run, name="snippet-pool-refresh", daemon=True).start()
+
+def invalidate_snippet_pool():
+    global _snippet_pool_expires
+    _snippet_pool_expires = 0
+
+@instrument_db
 def get_random_story_snippet():
-    db_path = os.environ.get("DB_PATH", "/tmp/union_app.db")
-    try:
-        with sqlite3.connect(db_path) as conn:
-            c = conn.cursor()
-            c.execute("SELECT story FROM stories WHERE draft = 0 ORDER BY RANDOM() LIMIT 1")
-            result = c.fetchone()
-            if result:
-                story = result[0]
-                words = story.split()
-                if len(words) > 10:
-                    start = random.randint(0, len(words) - 10)
-                    snippet = " ".join(words[start:start + 10])
-                    logging.info(f"Random snippet: {snippet}")
-                    return snippet
-                logging.info(f"Random snippet: {story}")
-                return story
-            logging.info("No stories for snippet")
-            return None
-    except sqlite3.Error as e:
-        logging.error(f"Get random story snippet failed: {e}")
-        return None
\ No newline at end of file
+    if not _snippet_pool:
+        refresh_snippet_pool()
+    elif _snippet_pool_expires < time.monotonic():
+        # Keep serving the stale pool while a fresh one is built
+        _refresh_snippet_pool_in_background()
+    pool = _snippet_pool
+    if pool:
+        snippet = random.choice(pool)
+        logging.info(f"Random snippet: {snippet}")
+        return snippet
+    logging.info("No stories for snippet")
+    return None
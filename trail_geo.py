@@ -0,0 +1,68 @@
+import sqlite3
+import csv
+import random
+import os
+import logging
+from trail_conn import get_connection
+from trail_versions import bump_version
+
+GAZETTEER_PATH = os.environ.get("GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer.csv"))
+
+DEFAULT_LOCATIONS = {
+    "usa": (37.0902, -95.7129), "canada": (56.1304, -106.3468), "uk": (55.3781, -3.4360),
+    "france": (46.6034, 1.8883), "brazil": (-14.2350, -51.9253), "australia": (-25.2744, 133.7751),
+    "miami lakes, fl": (25.9087, -80.3087)
+}
+
+def normalize_location(location):
+    return location.lower().strip() if location else ""
+
+def init_locations(c):
+    """Create and seed the geocode table; called from init_db inside its transaction."""
+    c.execute('''CREATE TABLE IF NOT EXISTS locations
+                 (name TEXT PRIMARY KEY, lat REAL NOT NULL, lon REAL NOT NULL)''')
+    c.executemany("INSERT OR IGNORE INTO locations (name, lat, lon) VALUES (?, ?, ?)",
+                  [(name, lat, lon) for name, (lat, lon) in DEFAULT_LOCATIONS.items()])
+
+def load_gazetteer(path=GAZETTEER_PATH):
+    """Load name,lat,lon rows from an offline gazetteer CSV; existing names are kept."""
+    if not os.path.exists(path):
+        logging.info(f"No gazetteer file at {path}")
+        return 0
+    try:
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = [(normalize_location(row["name"]), float(row["lat"]), float(row["lon"]))
+                    for row in csv.DictReader(f) if row.get("name")]
+        with get_connection() as conn:
+            conn.executemany("INSERT OR IGNORE INTO locations (name, lat, lon) VALUES (?, ?, ?)", rows)
+        logging.info(f"Loaded {len(rows)} gazetteer entries from {path}")
+        return len(rows)
+    except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+        logging.error(f"Load gazetteer failed: {e}")
+        return 0
+
+def resolve_location(c, location):
+    """Return (lat, lon) for a free-text location, or (None, None) when no location was given.
+
+    Unknown places get a random point, as the map always did, but it is now
+    picked once and stored with the story.
+    """
+    key = normalize_location(location)
+    if not key:
+        return None, None
+    c.execute("SELECT lat, lon FROM locations WHERE name = ?", (key,))
+    row = c.fetchone()
+    if row:
+        return row
+    return random.uniform(-90, 90), random.uniform(-180, 180)
+
+def backfill_story_coordinates(c):
+    """Geocode stories saved before coordinates were stored on the row."""
+    c.execute("SELECT id, location FROM stories WHERE lat IS NULL AND location IS NOT NULL AND location != ''")
+    rows = c.fetchall()
+    for story_id, location in rows:
+        lat, lon = resolve_location(c, location)
+        c.execute("UPDATE stories SET lat = ?, lon = ? WHERE id = ?", (lat, lon, story_id))
+    if rows:
+        bump_version(c, "stories")
+        logging.info(f"Backfilled coordinates for {len(rows)} stories")
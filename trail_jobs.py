@@ -0,0 +1,197 @@
+"""SQLite-backed background job queue.
+
+    python trail_jobs.py work [--once]     # run jobs until interrupted (or drain once)
+    python trail_jobs.py status            # job counts by kind and status
+
+Jobs are rows in the jobs table, so every gunicorn worker, the CLI worker and
+the web routes share one queue. An idempotency key makes enqueueing the same
+work twice (e.g. a redelivered Stripe webhook) a no-op. Handlers receive a
+batch of payloads of one kind; failed jobs are retried with exponential
+backoff up to JOB_MAX_ATTEMPTS.
+"""
+import sqlite3
+import threading
+import argparse
+import json
+import time
+import sys
+import os
+import logging
+from trail_conn import get_connection
+
+JOB_BATCH_SIZE = int(os.environ.get("JOB_BATCH_SIZE", 50))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1.0))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 8))
+JOB_RETRY_BASE = float(os.environ.get("JOB_RETRY_BASE", 5.0))
+# A running job whose lease expires (its worker died) is picked up again
+JOB_LEASE_SECONDS = 300
+# Finished jobs are kept this long so their idempotency keys keep deduplicating
+JOB_RETENTION_DAYS = 7
+# Run a worker thread inside each web process; set to 0 when a separate
+# `python trail_jobs.py work` process handles the queue
+JOB_WORKER_THREAD = os.environ.get("JOB_WORKER_THREAD", "1") == "1"
+
+_handlers = {}
+_worker_lock = threading.Lock()
+_worker_pid = None
+
+def init_jobs(c):
+    """Create the queue table; called from init_db inside its transaction."""
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs
+                 (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, idempotency_key TEXT UNIQUE,
+                  status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0,
+                  run_after REAL NOT NULL, locked_until REAL, last_error TEXT,
+                  created_at REAL NOT NULL, updated_at REAL NOT NULL)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs (status, run_after)")
+
+def register_handler(kind, handler):
+    """Register handler(payloads) for a job kind; it should raise to have the batch retried."""
+    _handlers[kind] = handler
+
+def enqueue(kind, payload, idempotency_key=None):
+    """Queue a job; returns its id, or None when a job with the same idempotency key already exists."""
+    now = time.time()
+    try:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute('''INSERT INTO jobs (kind, payload, idempotency_key, run_after, created_at, updated_at)
+                         VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (idempotency_key) DO NOTHING''',
+                      (kind, json.dumps(payload), idempotency_key, now, now, now))
+            job_id = c.lastrowid if c.rowcount else None
+    except sqlite3.Error as e:
+        logging.error(f"Enqueue {kind} job failed: {e}")
+        raise
+    if job_id is None:
+        logging.info(f"Duplicate {kind} job {idempotency_key} ignored")
+    else:
+        ensure_worker()
+    return job_id
+
+def _claim(now):
+    """Lease up to JOB_BATCH_SIZE due jobs of the oldest due kind; returns (kind, [(id, payload, attempts)])."""
+    with get_connection() as conn:
+        c = conn.cursor()
+        due = "(status = 'pending' AND run_after <= ?) OR (status = 'running' AND locked_until < ?)"
+        # Read first so an idle queue never takes the write lock
+        c.execute(f"SELECT kind FROM jobs WHERE {due} ORDER BY run_after LIMIT 1", (now, now))
+        row = c.fetchone()
+        if row is None:
+            return None, []
+        kind = row[0]
+        c.execute(f'''UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_until = ?, updated_at = ?
+                      WHERE id IN (SELECT id FROM jobs WHERE kind = ? AND ({due}) ORDER BY id LIMIT ?)
+                      RETURNING id, payload, attempts''',
+                  (now + JOB_LEASE_SECONDS, now, kind, now, now, JOB_BATCH_SIZE))
+        jobs = sorted(c.fetchall())
+    return kind, [(job_id, json.loads(payload), attempts) for job_id, payload, attempts in jobs]
+
+def _finish(done, failed):
+    """Mark done job ids finished and reschedule or give up on failed (id, attempts, error) jobs."""
+    now = time.time()
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.executemany("UPDATE jobs SET status = 'done', locked_until = NULL, last_error = NULL, updated_at = ? WHERE id = ?",
+                      [(now, job_id) for job_id in done])
+        for job_id, attempts, error in failed:
+            if attempts >= JOB_MAX_ATTEMPTS:
+                c.execute("UPDATE jobs SET status = 'failed', locked_until = NULL, last_error = ?, updated_at = ? WHERE id = ?",
+                          (error, now, job_id))
+                logging.error(f"Job {job_id} failed permanently after {attempts} attempts: {error}")
+            else:
+                c.execute("UPDATE jobs SET status = 'pending', locked_until = NULL, last_error = ?, run_after = ?, updated_at = ? WHERE id = ?",
+                          (error, now + JOB_RETRY_BASE * 2 ** (attempts - 1), now, job_id))
+
+def run_pending():
+    """Claim and run one batch; returns the number of jobs processed."""
+    kind, jobs = _claim(time.time())
+    if not jobs:
+        return 0
+    handler = _handlers.get(kind)
+    if handler is None:
+        _finish([], [(job_id, attempts, f"No handler for {kind}") for job_id, _, attempts in jobs])
+        return len(jobs)
+    try:
+        handler([payload for _, payload, _ in jobs])
+        _finish([job_id for job_id, _, _ in jobs], [])
+    except Exception as e:
+        if len(jobs) == 1:
+            logging.warning(f"{kind} job {jobs[0][0]} failed: {e}")
+            _finish([], [(jobs[0][0], jobs[0][2], str(e))])
+            return 1
+        # Retry one by one so a single bad job doesn't hold back the rest of the batch
+        logging.warning(f"{kind} batch of {len(jobs)} failed ({e}); running jobs individually")
+        done, failed = [], []
+        for job_id, payload, attempts in jobs:
+            try:
+                handler([payload])
+                done.append(job_id)
+            except Exception as job_error:
+                failed.append((job_id, attempts, str(job_error)))
+        _finish(done, failed)
+    logging.info(f"Ran {len(jobs)} {kind} jobs")
+    return len(jobs)
+
+def prune_jobs():
+    cutoff = time.time() - JOB_RETENTION_DAYS * 86400
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (cutoff,))
+        return c.rowcount
+
+def work(once=False):
+    """Process jobs until interrupted; with once=True stop when the queue is drained."""
+    last_prune = 0
+    while True:
+        try:
+            processed = run_pending()
+            if time.monotonic() - last_prune > 3600:
+                last_prune = time.monotonic()
+                prune_jobs()
+        except sqlite3.Error as e:
+            logging.error(f"Job worker error: {e}")
+            processed = 0
+        if not processed:
+            if once:
+                return
+            time.sleep(JOB_POLL_INTERVAL)
+
+def ensure_worker():
+    """Start this process's background worker thread if JOB_WORKER_THREAD is on and it isn't running."""
+    global _worker_pid
+    if not JOB_WORKER_THREAD:
+        return
+    with _worker_lock:
+        if _worker_pid == os.getpid():
+            return
+        _worker_pid = os.getpid()
+    threading.Thread(target=work, name="job-worker", daemon=True).start()
+
+def job_counts():
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status ORDER BY kind, status")
+        return c.fetchall()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run or inspect the background job queue")
+    parser.add_argument("command", choices=["work", "status"])
+    parser.add_argument("--once", action="store_true", help="exit when no jobs are due")
+    args = parser.parse_args(argv)
+    from trail_db import init_db
+    import trail_payments  # registers the Stripe job handlers
+    init_db()
+    if args.command == "work":
+        if not _handlers:
+            # Without handlers every job would fail until it is given up on
+            parser.error("no job handlers registered")
+        work(once=args.once)
+    else:
+        for kind, status, count in job_counts():
+            print(f"{kind} {status}: {count}")
+    return 0
+
+if __name__ == "__main__":
+    # Run through the importable module: trail_payments registers its handlers on
+    # trail_jobs, which as a script would be a second copy of this file
+    import trail_jobs
+    sys.exit(trail_jobs.main())
@@ -0,0 +1,91 @@
+import sqlite3
+import sys
+import logging
+from trail_conn import get_connection
+
+# user_totals.month for the all-time board; monthly rows use the stories.month value (YYYY-MM)
+ALL_TIME = ""
+
+def init_leaderboard(c):
+    """Create the materialized totals table; called from init_db inside its transaction."""
+    c.execute('''CREATE TABLE IF NOT EXISTS user_totals
+                 (user_id INTEGER NOT NULL, month TEXT NOT NULL, total_cheers INTEGER NOT NULL DEFAULT 0,
+                  PRIMARY KEY (user_id, month))''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_totals_month_cheers ON user_totals (month, total_cheers DESC)")
+
+def adjust_story(c, story_id, sign=1, cheers=None):
+    """Add (sign=1) or remove (sign=-1) a published story's cheers from its author's totals.
+
+    With cheers=None the story's current count is used, which is how a newly
+    published story creates its author's row; pass cheers to apply a delta.
+    """
+    c.execute("SELECT user_id, month, cheers FROM stories WHERE id = ? AND draft = 0", (story_id,))
+    row = c.fetchone()
+    if not row:
+        return
+    user_id, month, current = row
+    delta = sign * (current if cheers is None else cheers)
+    for key in ([ALL_TIME, month] if month else [ALL_TIME]):
+        c.execute('''INSERT INTO user_totals (user_id, month, total_cheers) VALUES (?, ?, ?)
+                     ON CONFLICT (user_id, month) DO UPDATE SET total_cheers = total_cheers + excluded.total_cheers''',
+                  (user_id, key, delta))
+
+def _totals_query():
+    return '''SELECT user_id, ? AS month, SUM(cheers) AS total FROM stories WHERE draft = 0 GROUP BY user_id
+              UNION ALL
+              SELECT user_id, month, SUM(cheers) AS total FROM stories WHERE draft = 0 AND month IS NOT NULL GROUP BY user_id, month'''
+
+def rebuild_leaderboard():
+    """Recompute user_totals from stories in one transaction."""
+    try:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("DELETE FROM user_totals")
+            c.execute(f"INSERT INTO user_totals (user_id, month, total_cheers) {_totals_query()}", (ALL_TIME,))
+            logging.info(f"Leaderboard rebuilt with {c.rowcount} rows")
+            return c.rowcount
+    except sqlite3.Error as e:
+        logging.error(f"Rebuild leaderboard failed: {e}")
+        return 0
+
+def verify_leaderboard():
+    """Return the (user_id, month, expected, stored) rows where user_totals has drifted from stories."""
+    try:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute(f'''SELECT e.user_id, e.month, e.total, t.total_cheers
+                          FROM ({_totals_query()}) AS e
+                          LEFT JOIN user_totals t ON t.user_id = e.user_id AND t.month = e.month
+                          WHERE t.total_cheers IS NULL OR t.total_cheers != e.total''', (ALL_TIME,))
+            mismatches = c.fetchall()
+            logging.info(f"Leaderboard verify found {len(mismatches)} mismatches")
+            return mismatches
+    except sqlite3.Error as e:
+        logging.error(f"Verify leaderboard failed: {e}")
+        return []
+
+def get_leaderboard(limit=10, month=ALL_TIME):
+    try:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT u.username, t.total_cheers FROM user_totals t JOIN users u ON t.user_id = u.id WHERE t.month = ? ORDER BY t.total_cheers DESC LIMIT ?",
+                      (month or ALL_TIME, limit))
+            leaders = c.fetchall()
+            logging.info(f"Fetched leaderboard with {len(leaders)} entries")
+            return leaders
+    except sqlite3.Error as e:
+        logging.error(f"Get leaderboard failed: {e}")
+        return []
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "rebuild":
+        print(f"Rebuilt {rebuild_leaderboard()} leaderboard rows")
+    elif command == "verify":
+        mismatches = verify_leaderboard()
+        for user_id, month, expected, stored in mismatches:
+            print(f"user {user_id} month '{month}': expected {expected}, stored {stored}")
+        sys.exit(1 if mismatches else 0)
+    else:
+        print("Usage: python trail_leaderboard.py rebuild|verify")
+        sys.exit(2)
@@ -0,0 +1,28 @@
+import logging
+import logging.handlers
+import queue
+import atexit
+import os
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+_listener = None
+
+def configure_logging(level=None):
+    """Send log records through a queue so request threads never block on the stream write.
+
+    Safe to call from every module; only the first call installs the handlers.
+    """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level or LOG_LEVEL)
+    if _listener is not None:
+        return
+    log_queue = queue.SimpleQueue()
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter(LOG_FORMAT))
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -0,0 +1,282 @@
+import sqlite3
+import threading
+import time
+import functools
+import os
+import logging
+
+# Statements slower than this (execute plus fetches) are logged with their query plan; 0 disables
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 0))
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Each gunicorn worker keeps its own counters, and a scrape reaches whichever
+# worker accepts it. With "sqlite" every worker adds its increments to shared
+# tables and /metrics reports server-wide totals, so counters never appear to
+# reset; "local" reports only the answering process (fine for one process).
+METRICS_BACKEND = os.environ.get("METRICS_BACKEND", "sqlite")
+# Seconds between a worker's writes to the shared tables; a worker that dies
+# loses at most this much
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", 10))
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_help = {}
+_local = threading.local()
+_flush_lock = threading.Lock()
+# (series name, labels) -> value already added to the shared tables
+_flushed = {}
+_last_flush = [0.0]
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc(name, value=1, help_text="", **labels):
+    with _lock:
+        _help.setdefault(name, ("counter", help_text))
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, value, help_text="", buckets=DEFAULT_BUCKETS, **labels):
+    with _lock:
+        _help.setdefault(name, ("histogram", help_text))
+        key = _key(name, labels)
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                hist["counts"][i] += 1
+        hist["sum"] += value
+        hist["count"] += 1
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in items]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+def _series():
+    """Flatten this process's metrics into ({family: (kind, help)}, [(family, series, labels, value)])."""
+    series = []
+    with _lock:
+        for (name, labels), value in sorted(_counters.items()):
+            series.append((name, name, _format_labels(labels), value))
+        for (name, labels), hist in sorted(_histograms.items()):
+            for bound, count in zip(hist["buckets"], hist["counts"]):
+                series.append((name, f"{name}_bucket", _format_labels(labels, [('le', bound)]), count))
+            series.append((name, f"{name}_bucket", _format_labels(labels, [('le', '+Inf')]), hist["count"]))
+            series.append((name, f"{name}_sum", _format_labels(labels), hist["sum"]))
+            series.append((name, f"{name}_count", _format_labels(labels), hist["count"]))
+        return dict(_help), series
+
+def init_metrics(c):
+    """Create the shared metric tables; called from init_db inside its transaction."""
+    c.execute('''CREATE TABLE IF NOT EXISTS metric_families
+                 (family TEXT PRIMARY KEY, kind TEXT NOT NULL, help TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS metric_series
+                 (family TEXT NOT NULL, series TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL,
+                  PRIMARY KEY (series, labels))''')
+
+def flush(force=False):
+    """Add this process's increments since its last flush to the shared tables.
+
+    Without force, writes at most once per METRICS_FLUSH_SECONDS.
+    """
+    if METRICS_BACKEND != "sqlite":
+        return
+    # Imported here: trail_conn imports this module for its instrumented connection
+    from trail_conn import get_connection
+    with _flush_lock:
+        if not force and time.monotonic() - _last_flush[0] < METRICS_FLUSH_SECONDS:
+            return
+        _last_flush[0] = time.monotonic()
+        families, series = _series()
+        # New series are written even at zero so each histogram's rows are created together
+        deltas = [(family, name, labels, value - _flushed.get((name, labels), 0))
+                  for family, name, labels, value in series
+                  if (name, labels) not in _flushed or value != _flushed[(name, labels)]]
+        if not deltas:
+            return
+        try:
+            with get_connection() as conn:
+                conn.executemany("INSERT INTO metric_families (family, kind, help) VALUES (?, ?, ?) ON CONFLICT (family) DO NOTHING",
+                                 [(family, kind, help_text) for family, (kind, help_text) in families.items()])
+                conn.executemany('''INSERT INTO metric_series (family, series, labels, value) VALUES (?, ?, ?, ?)
+                                    ON CONFLICT (series, labels) DO UPDATE SET value = value + excluded.value''', deltas)
+        except sqlite3.Error as e:
+            logging.error(f"Metrics flush failed: {e}")
+            return
+        for _, name, labels, delta in deltas:
+            _flushed[(name, labels)] = _flushed.get((name, labels), 0) + delta
+
+def _format_value(value):
+    return int(value) if float(value).is_integer() else value
+
+def _render(families, series):
+    lines = []
+    for family in sorted(families):
+        kind, help_text = families[family]
+        if help_text:
+            lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {kind}")
+        for name, labels, value in series.get(family, []):
+            lines.append(f"{name}{labels} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+def render_prometheus():
+    """Render metrics in the Prometheus text exposition format.
+
+    With the "sqlite" backend these are the totals of every process; with
+    "local" (or if the shared tables can't be read) only this process's.
+    """
+    if METRICS_BACKEND == "sqlite":
+        from trail_conn import get_connection
+        flush(force=True)
+        try:
+            with get_connection() as conn:
+                c = conn.cursor()
+                c.execute("SELECT family, kind, help FROM metric_families")
+                families = {family: (kind, help_text) for family, kind, help_text in c.fetchall()}
+                # rowid keeps each histogram's buckets in the order they were first written
+                c.execute("SELECT family, series, labels, value FROM metric_series ORDER BY family, rowid")
+                series = {}
+                for family, name, labels, value in c.fetchall():
+                    series.setdefault(family, []).append((name, labels, value))
+            return _render(families, series)
+        except sqlite3.Error as e:
+            logging.error(f"Reading shared metrics failed, reporting this process only: {e}")
+    families, flat = _series()
+    series = {}
+    for family, name, labels, value in flat:
+        series.setdefault(family, []).append((name, labels, value))
+    return _render(families, series)
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _help.clear()
+    _flushed.clear()
+
+def _after_fork():
+    # A worker starts from zero; what the master recorded before forking isn't its own
+    global _lock, _flush_lock
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    reset()
+    _last_flush[0] = 0.0
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def current_function():
+    return getattr(_local, "function", None) or "other"
+
+def request_stats():
+    """Per-thread query tally for the current request: {"queries", "sql_seconds", "rows"}."""
+    stats = getattr(_local, "request", None)
+    if stats is None:
+        stats = _local.request = {"queries": 0, "sql_seconds": 0.0, "rows": 0}
+    return stats
+
+def start_request():
+    _local.request = {"queries": 0, "sql_seconds": 0.0, "rows": 0}
+
+def instrument_db(func):
+    """Time a trail_db function and attribute the SQL it runs to it."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, "function", None)
+        _local.function = func.__name__
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.function = previous
+            observe("union_db_function_seconds", time.perf_counter() - start,
+                    "Wall time of trail_db functions", function=func.__name__)
+    return wrapper
+
+def _record_sql(seconds, rows, query=0):
+    function = current_function()
+    stats = request_stats()
+    stats["sql_seconds"] += seconds
+    stats["rows"] += rows
+    stats["queries"] += query
+    if query:
+        inc("union_db_queries_total", query, "SQL statements executed", function=function)
+    inc("union_db_sql_seconds_total", seconds, "Time spent in execute and fetch", function=function)
+    if rows:
+        inc("union_db_rows_total", rows, "Rows returned by fetches", function=function)
+
+class InstrumentedCursor(sqlite3.Cursor):
+    _sql = None
+    _params = ()
+    _elapsed = 0.0
+    _slow_logged = False
+
+    def _check_slow(self):
+        if SLOW_QUERY_MS and not self._slow_logged and self._elapsed * 1000 >= SLOW_QUERY_MS:
+            self._slow_logged = True
+            plan = ""
+            try:
+                plan_cursor = self.connection.cursor(sqlite3.Cursor)
+                rows = plan_cursor.execute(f"EXPLAIN QUERY PLAN {self._sql}", self._params).fetchall()
+                plan = "; ".join(row[-1] for row in rows)
+            except sqlite3.Error as e:
+                plan = f"unavailable ({e})"
+            logging.warning(f"Slow query in {current_function()} ({self._elapsed * 1000:.1f}ms): {' '.join(self._sql.split())} | plan: {plan}")
+
+    def execute(self, sql, params=()):
+        self._sql, self._params, self._elapsed, self._slow_logged = sql, params, 0.0, False
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            seconds = time.perf_counter() - start
+            self._elapsed += seconds
+            _record_sql(seconds, 0, query=1)
+            self._check_slow()
+
+    def executemany(self, sql, seq_of_params):
+        self._sql, self._params, self._elapsed, self._slow_logged = sql, (), 0.0, True
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_params)
+        finally:
+            _record_sql(time.perf_counter() - start, 0, query=1)
+
+    def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        result = fetch(*args)
+        seconds = time.perf_counter() - start
+        self._elapsed += seconds
+        return result, seconds
+
+    def fetchone(self):
+        row, seconds = self._timed_fetch(super().fetchone)
+        _record_sql(seconds, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows, seconds = self._timed_fetch(super().fetchmany, size if size is not None else self.arraysize)
+        _record_sql(seconds, len(rows))
+        self._check_slow()
+        return rows
+
+    def fetchall(self):
+        rows, seconds = self._timed_fetch(super().fetchall)
+        _record_sql(seconds, len(rows))
+        self._check_slow()
+        return rows
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
@@ -1,23 +1,140 @@
-import stripe
-from trail_db import get_user_email
+import json
+import os
+import logging
+from urllib.parse import urlencode
+from trail_db import get_user_email, get_payment_link, save_payment_link, apply_subscription_changes
+from trail_jobs import enqueue, register_handler
+
+# Subscription states that grant or revoke access in customer.subscription.* events
+ACTIVE_STATUSES = {"active", "trialing"}
+INACTIVE_STATUSES = {"canceled", "unpaid", "incomplete_expired"}
+HANDLED_EVENTS = {"checkout.session.completed", "customer.subscription.updated", "customer.subscription.deleted"}
 
 class PaymentHandler:
-    def __init__(self, stripe_secret_key):
-        stripe.api_key = stripe_secret_key
+    def __init__(self, stripe_secret_key, api_base=None, webhook_secret=None):
+        self.stripe_secret_key = stripe_secret_key
+        # Point at a local Stripe stub (e.g. stripe-mock) for testing
+        self.api_base = api_base or os.environ.get("STRIPE_API_BASE")
+        self.webhook_secret = webhook_secret or os.environ.get("STRIPE_WEBHOOK_SECRET")
+        self._stripe = None
+        self._links = {}
         # Replace with your actual Render URL
         self.success_url = "https://union-app.onrender.com/success?session_id={CHECKOUT_SESSION_ID}"
-        self.cancel_url = "https://union-app.onrender.com"
 
-    def create_subscription(self, username, price_id="price_12345"):
-        try:
-            session = stripe.checkout.Session.create(
-                payment_method_types=["card"],
+    def _get_stripe(self):
+        # The stripe SDK is imported on the first payment, not at worker boot
+        if self._stripe is None:
+            import stripe
+            stripe.api_key = self.stripe_secret_key
+            if self.api_base:
+                stripe.api_base = self.api_base
+            self._stripe = stripe
+        return self._stripe
+
+    def _payment_link(self, price_id):
+        """Return the reusable Payment Link for a price, creating it once for all workers."""
+        url = self._links.get(price_id) or get_payment_link(price_id)
+        if url is None:
+            stripe = self._get_stripe()
+            link = stripe.PaymentLink.create(
                 line_items=[{"price": price_id, "quantity": 1}],
-                mode="subscription",
-                success_url=self.success_url,
-                cancel_url=self.cancel_url,
-                customer_email=get_user_email(username),
+                after_completion={"type": "redirect", "redirect": {"url": self.success_url}},
+                idempotency_key=f"union-payment-link-{price_id}",
             )
-            return session.url, None
+            url = save_payment_link(price_id, link.url)
+            logging.info(f"Created payment link for {price_id}")
+        self._links[price_id] = url
+        return url
+
+    def _checkout_url(self, link_url, username, email):
+        # The webhook maps the completed checkout back to the user through client_reference_id
+        params = {"client_reference_id": username}
+        if email:
+            params["prefilled_email"] = email
+        return f"{link_url}?{urlencode(params)}"
+
+    def create_subscription(self, username, price_id="price_12345"):
+        """Return (checkout URL, error); after the first call per price no Stripe request is made."""
+        email = get_user_email(username)
+        if price_id in self._links:
+            return self._checkout_url(self._links[price_id], username, email), None
+        stripe = self._get_stripe()
+        try:
+            return self._checkout_url(self._payment_link(price_id), username, email), None
+        except stripe.error.StripeError as e:
+            return None, f"Payment failed: {str(e)}"
+
+    async def create_subscription_async(self, username, price_id="price_12345"):
+        """Same as create_subscription, without blocking the event loop."""
+        from trail_async import run_db, run_payment
+        email = await run_db(get_user_email, username)
+        if price_id in self._links:
+            return self._checkout_url(self._links[price_id], username, email), None
+        stripe = self._get_stripe()
+        try:
+            link_url = await run_payment(self._payment_link, price_id)
+            return self._checkout_url(link_url, username, email), None
         except stripe.error.StripeError as e:
-            return None, f"Payment failed: {str(e)}"
\ No newline at end of file
+            return None, f"Payment failed: {str(e)}"
+
+    def parse_webhook(self, payload, signature):
+        """Verify a webhook's Stripe-Signature and return (event dict, error)."""
+        if not self.webhook_secret:
+            return None, "Webhook secret not configured"
+        stripe = self._get_stripe()
+        try:
+            stripe.Webhook.construct_event(payload, signature, self.webhook_secret)
+        except (ValueError, stripe.error.SignatureVerificationError) as e:
+            return None, f"Invalid webhook: {str(e)}"
+        return json.loads(payload), None
+
+    def queue_webhook(self, event):
+        """Queue a verified event for the job worker; Stripe redeliveries share the event id and are dropped."""
+        if event.get("type") not in HANDLED_EVENTS:
+            return None
+        return enqueue("stripe_event", event, idempotency_key=f"stripe-event:{event['id']}")
+
+    def queue_checkout_check(self, session_id):
+        """Ask the job worker to confirm a checkout session with Stripe, in case the webhook is slow."""
+        return enqueue("stripe_checkout_session", {"session_id": session_id},
+                       idempotency_key=f"stripe-checkout:{session_id}")
+
+    def retrieve_checkout_session(self, session_id):
+        stripe = self._get_stripe()
+        try:
+            return stripe.checkout.Session.retrieve(session_id).to_dict()
+        except stripe.error.InvalidRequestError as e:
+            # Unknown or malformed id; retrying won't help
+            logging.warning(f"Checkout session {session_id} not found: {e}")
+            return None
+
+def subscription_change(event_type, obj):
+    """Translate a Stripe object into a (username, customer_id, subscribed) change, or None."""
+    if event_type == "checkout.session.completed":
+        if obj.get("payment_status") in ("paid", "no_payment_required") and obj.get("client_reference_id"):
+            return obj["client_reference_id"], obj.get("customer"), True
+    elif event_type == "customer.subscription.deleted":
+        return None, obj.get("customer"), False
+    elif event_type == "customer.subscription.updated":
+        if obj.get("status") in ACTIVE_STATUSES:
+            return None, obj.get("customer"), True
+        if obj.get("status") in INACTIVE_STATUSES:
+            return None, obj.get("customer"), False
+    return None
+
+default_handler = PaymentHandler(os.environ.get("STRIPE_SECRET_KEY"))
+
+def handle_stripe_events(events):
+    changes = [subscription_change(event["type"], event["data"]["object"]) for event in events]
+    apply_subscription_changes([change for change in changes if change])
+
+def handle_checkout_sessions(payloads):
+    changes = []
+    for payload in payloads:
+        checkout = default_handler.retrieve_checkout_session(payload["session_id"])
+        if checkout is not None:
+            changes.append(subscription_change("checkout.session.completed", checkout))
+    apply_subscription_changes([change for change in changes if change])
+
+register_handler("stripe_event", handle_stripe_events)
+register_handler("stripe_checkout_session", handle_checkout_sessions)
@@ -0,0 +1,113 @@
+import sqlite3
+import threading
+import random
+import time
+import os
+import logging
+from datetime import date
+from trail_conn import get_connection, get_db_path
+
+def _parse_limit(value):
+    """Parse "10/60" into (capacity 10, refill 10 tokens per 60 seconds); "0" disables the bucket."""
+    count, _, seconds = value.partition("/")
+    count = float(count)
+    return (count, count / float(seconds or 60)) if count > 0 else None
+
+# Token buckets per route, keyed by user when logged in and by client IP otherwise
+RATE_LIMITS = {
+    "login": _parse_limit(os.environ.get("RATE_LIMIT_LOGIN", "10/60")),
+    "cheer": _parse_limit(os.environ.get("RATE_LIMIT_CHEER", "30/60")),
+    "submit": _parse_limit(os.environ.get("RATE_LIMIT_SUBMIT", "5/60")),
+}
+# Buckets live in their own SQLite file so a token spent on every cheer or
+# login doesn't take the main database's write lock (see trail_cheers)
+RATE_LIMIT_DB_PATH = os.environ.get("RATE_LIMIT_DB_PATH")
+# Roughly one call in PRUNE_EVERY deletes buckets that have refilled completely
+PRUNE_EVERY = 500
+_BLOCKED_MAX = 10000
+
+# key -> monotonic time until which the key is known to be empty, so a client
+# hammering a limit is turned away without touching the database
+_blocked = {}
+_blocked_lock = threading.Lock()
+
+def bucket_db_path():
+    return RATE_LIMIT_DB_PATH or f"{get_db_path()}.ratelimit"
+
+def init_ratelimit(c):
+    """Create the quota table and the bucket database; called from init_db inside its transaction."""
+    # Buckets from versions that kept them in the main database
+    c.execute("DROP TABLE IF EXISTS rate_limits")
+    conn = get_connection(bucket_db_path())
+    conn.execute("PRAGMA journal_mode = WAL")
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS rate_limits
+                        (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL) WITHOUT ROWID''')
+    c.execute("SELECT 1 FROM sqlite_master WHERE name = 'story_quota'")
+    exists = c.fetchone() is not None
+    c.execute('''CREATE TABLE IF NOT EXISTS story_quota
+                 (user_id INTEGER PRIMARY KEY, day TEXT NOT NULL, submitted INTEGER NOT NULL)''')
+    if not exists:
+        # Count stories already published today so the switch doesn't reset anyone's quota
+        today = date.today().isoformat()
+        c.execute('''INSERT INTO story_quota (user_id, day, submitted)
+                     SELECT user_id, ?, COUNT(*) FROM stories
+                     WHERE draft = 0 AND submitted_at >= ? AND user_id IS NOT NULL GROUP BY user_id''', (today, today))
+
+def take_token(route, identity):
+    """Spend one token from the route's bucket for identity; returns (allowed, retry_after_seconds)."""
+    limit = RATE_LIMITS.get(route)
+    if limit is None:
+        return True, 0
+    capacity, rate = limit
+    key = f"{route}:{identity}"
+    with _blocked_lock:
+        until = _blocked.get(key)
+    if until is not None and until > time.monotonic():
+        return False, until - time.monotonic()
+    now = time.time()
+    try:
+        with get_connection(bucket_db_path()) as conn:
+            c = conn.cursor()
+            # One statement, so concurrent workers can't both spend the last token
+            c.execute('''INSERT INTO rate_limits (key, tokens, updated_at) VALUES (?, ? - 1, ?)
+                         ON CONFLICT (key) DO UPDATE
+                         SET tokens = MIN(?, tokens + (excluded.updated_at - updated_at) * ?) - 1, updated_at = excluded.updated_at
+                         WHERE MIN(?, tokens + (excluded.updated_at - updated_at) * ?) >= 1
+                         RETURNING tokens''', (key, capacity, now, capacity, rate, capacity, rate))
+            allowed = bool(c.fetchall())
+            if allowed:
+                if random.randrange(PRUNE_EVERY) == 0:
+                    _prune(c, now)
+                return True, 0
+            c.execute("SELECT tokens, updated_at FROM rate_limits WHERE key = ?", (key,))
+            tokens, updated_at = c.fetchone()
+    except sqlite3.Error as e:
+        # Fail open: a broken limiter shouldn't take the site down
+        logging.error(f"Rate limit check failed: {e}")
+        return True, 0
+    retry_after = max(0.0, (1 - min(capacity, tokens + (now - updated_at) * rate)) / rate)
+    with _blocked_lock:
+        if len(_blocked) >= _BLOCKED_MAX:
+            _blocked.clear()
+        _blocked[key] = time.monotonic() + retry_after
+    logging.warning(f"Rate limited {key} for {retry_after:.1f}s")
+    return False, retry_after
+
+def _prune(c, now):
+    # A bucket idle long enough to refill completely is the same as no row
+    longest = max(capacity / rate for capacity, rate in filter(None, RATE_LIMITS.values()))
+    c.execute("DELETE FROM rate_limits WHERE updated_at < ?", (now - longest,))
+    if c.rowcount:
+        logging.info(f"Pruned {c.rowcount} idle rate limit buckets")
+
+def take_daily_quota(c, user_id, limit):
+    """Count one published story against the user's quota for today; False once limit is reached.
+
+    Call inside the submitting transaction so a failed insert rolls the count back.
+    """
+    c.execute('''INSERT INTO story_quota (user_id, day, submitted) VALUES (?, ?, 1)
+                 ON CONFLICT (user_id) DO UPDATE
+                 SET submitted = CASE WHEN day = excluded.day THEN submitted + 1 ELSE 1 END, day = excluded.day
+                 WHERE day != excluded.day OR submitted < ?''', (user_id, date.today().isoformat(), limit))
+    return c.rowcount > 0
@@ -0,0 +1,126 @@
+import sqlite3
+import re
+import logging
+from trail_conn import get_connection
+from trail_bodies import BODY_TABLES, decompress_story
+
+SEARCH_PAGE_SIZE = 20
+SNIPPET_TOKENS = 16
+
+# One FTS5 table covers both sources; rowid = id * 2 for stories and id * 2 + 1
+# for archived_stories. Bodies are stored compressed (see trail_bodies), so
+# save_body writes the plain text here through index_body; the triggers only
+# keep titles, locations and deletes in sync and use nothing but SQL built-ins,
+# so any sqlite3 connection can still write to the tables.
+# table -> (rowid offset, kind, filter on the source row t)
+_SOURCES = {
+    "stories": (0, "story", "t.draft = 0"),
+    "archived_stories": (1, "archive", "1"),
+}
+_TRIGGERS = {
+    "stories_search_update": '''AFTER UPDATE OF title, location, draft ON stories BEGIN
+           DELETE FROM search_index WHERE rowid = old.id * 2 AND new.draft != 0;
+           UPDATE search_index SET title = new.title, location = new.location
+           WHERE rowid = old.id * 2 AND new.draft = 0;
+       END''',
+    "stories_search_delete": '''AFTER DELETE ON stories BEGIN
+           DELETE FROM search_index WHERE rowid = old.id * 2;
+       END''',
+    # close_month archives a story under the same id, so its indexed text is reused
+    "archive_search_insert": '''AFTER INSERT ON archived_stories BEGIN
+           INSERT INTO search_index (rowid, title, story, location, username, kind, ref_id)
+           VALUES (new.id * 2 + 1, new.title, (SELECT story FROM search_index WHERE rowid = new.id * 2), new.location,
+                   (SELECT username FROM users WHERE id = new.user_id), 'archive', new.id);
+       END''',
+    "archive_search_update": '''AFTER UPDATE OF title, location ON archived_stories BEGIN
+           UPDATE search_index SET title = new.title, location = new.location WHERE rowid = old.id * 2 + 1;
+       END''',
+    "archive_search_delete": '''AFTER DELETE ON archived_stories BEGIN
+           DELETE FROM search_index WHERE rowid = old.id * 2 + 1;
+       END''',
+}
+# Triggers from earlier versions that read bodies through a Python SQL function
+_OLD_TRIGGERS = ("stories_search_insert", "story_bodies_search_insert", "story_bodies_search_update",
+                 "archived_bodies_search_insert", "archived_bodies_search_update")
+
+def _has_index(c):
+    c.execute("SELECT 1 FROM sqlite_master WHERE name = 'search_index'")
+    return c.fetchone() is not None
+
+def index_body(c, table, story_id, text):
+    """Replace a story's search entry with its current row and plain text; drafts are left out."""
+    if not _has_index(c):
+        return
+    offset, kind, published = _SOURCES[table]
+    c.execute("DELETE FROM search_index WHERE rowid = ?", (story_id * 2 + offset,))
+    c.execute(f'''INSERT INTO search_index (rowid, title, story, location, username, kind, ref_id)
+                   SELECT t.id * 2 + ?, t.title, ?, t.location, u.username, ?, t.id
+                   FROM {table} t LEFT JOIN users u ON t.user_id = u.id
+                   WHERE t.id = ? AND {published}''', (offset, text, kind, story_id))
+
+def _build_index(c):
+    for table, bodies in BODY_TABLES.items():
+        offset, kind, published = _SOURCES[table]
+        c.execute(f'''SELECT t.id * 2 + ?, t.title, b.body, t.location, u.username, ?, t.id
+                       FROM {table} t LEFT JOIN users u ON t.user_id = u.id
+                       LEFT JOIN {bodies} b ON b.story_id = t.id WHERE {published}''', (offset, kind))
+        c.executemany('''INSERT INTO search_index (rowid, title, story, location, username, kind, ref_id)
+                         VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                      [(rowid, title, decompress_story(body), *rest) for rowid, title, body, *rest in c.fetchall()])
+
+def init_search(c):
+    """Create the FTS5 index and its sync triggers, indexing existing rows the first time."""
+    exists = _has_index(c)
+    if not exists:
+        try:
+            c.execute('''CREATE VIRTUAL TABLE search_index USING fts5
+                         (title, story, location, username, kind UNINDEXED, ref_id UNINDEXED, tokenize = 'porter unicode61')''')
+        except sqlite3.OperationalError as e:
+            logging.error(f"Full-text search unavailable: {e}")
+            return
+    # Schema changes make every worker re-prepare its statements, so only
+    # triggers that are missing or differ from this version are touched
+    c.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'")
+    installed = dict(c.fetchall())
+    for name in _OLD_TRIGGERS:
+        if name in installed:
+            c.execute(f"DROP TRIGGER {name}")
+    for name, body in _TRIGGERS.items():
+        sql = f"CREATE TRIGGER {name} {body}"
+        if installed.get(name) != sql:
+            c.execute(f"DROP TRIGGER IF EXISTS {name}")
+            c.execute(sql)
+            logging.info(f"Search trigger {name} updated")
+    if not exists:
+        _build_index(c)
+        logging.info("Search index built")
+
+def build_match_query(text):
+    """Turn free text into an FTS5 query of quoted prefix terms, so user input can't be FTS syntax."""
+    terms = re.findall(r"\w+", text or "")
+    return " ".join(f'"{term}"*' for term in terms)
+
+def search_stories(text, page=1, page_size=SEARCH_PAGE_SIZE):
+    """Return (results, has_more) for one page of ranked matches.
+
+    Each result is (kind, id, title, username, location, snippet) where kind is
+    'story' or 'archive' and matches in the snippet are wrapped in [ ].
+    """
+    query = build_match_query(text)
+    if not query:
+        return [], False
+    page = max(1, page)
+    try:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute(f'''SELECT kind, ref_id, title, username, location,
+                                 snippet(search_index, 1, '[', ']', '...', {SNIPPET_TOKENS})
+                          FROM search_index WHERE search_index MATCH ?
+                          ORDER BY bm25(search_index, 5.0, 1.0, 2.0, 2.0) LIMIT ? OFFSET ?''',
+                      (query, page_size + 1, (page - 1) * page_size))
+            results = c.fetchall()
+            logging.info(f"Search '{text}' page {page}: {len(results[:page_size])} results")
+            return results[:page_size], len(results) > page_size
+    except sqlite3.Error as e:
+        logging.error(f"Search stories failed: {e}")
+        return [], False
@@ -0,0 +1,217 @@
+"""Bulk export/import of users, stories, cheers and archived_stories.
+
+    python trail_transfer.py export DIR [--format ndjson|csv] [--tables users,stories]
+    python trail_transfer.py import DIR [--format ndjson|csv] [--tables ...]
+
+Each table streams to or from DIR/<table>.<format> in batches of
+--batch-size rows, so memory use does not grow with the table. Progress is
+checkpointed in DIR/.checkpoint.<format>.json after every batch, and re-running the
+same command resumes where it stopped; --restart ignores the checkpoint.
+Imported rows keep their ids and conflicts are skipped, so an import can be
+replayed safely.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import logging
+from trail_conn import get_connection
+from trail_validation import MAX_STORY_CHARS, check_username, check_email, check_submission
+from trail_bodies import BODY_TABLES, save_body
+from trail_versions import bump_version
+
+BATCH_SIZE = 1000
+
+# Columns and their types, in import order; the types restore CSV values
+TABLES = {
+    "users": [("id", int), ("username", str), ("subscribed", int), ("avatar_path", str), ("email", str),
+              ("stripe_customer_id", str)],
+    "stories": [("id", int), ("user_id", int), ("title", str), ("story", str), ("cheers", int),
+                ("submitted_at", str), ("month", str), ("image_path", str), ("draft", int),
+                ("location", str), ("lat", float), ("lon", float)],
+    "cheers": [("story_id", int), ("user_id", int), ("cheered_at", str)],
+    "archived_stories": [("id", int), ("user_id", int), ("title", str), ("story", str), ("cheers", int),
+                         ("month", str), ("image_path", str), ("archived_at", str), ("location", str)],
+}
+
+def validate_row(table, row):
+    """Apply the same rules as the web forms; returns an error string or None."""
+    if table == "users":
+        if not check_username(row["username"]).valid:
+            return "invalid username"
+        if row["email"] is not None and not check_email(row["email"]).valid:
+            return "invalid email"
+    elif table in ("stories", "archived_stories"):
+        result = check_submission(row["title"], row["story"])
+        if not result.valid:
+            return f"invalid {result.field}: {result.reason}"
+    return None
+
+class Checkpoint:
+    def __init__(self, directory, fmt, restart=False):
+        self.path = os.path.join(directory, f".checkpoint.{fmt}.json")
+        self.state = {}
+        if not restart and os.path.exists(self.path):
+            with open(self.path) as f:
+                self.state = json.load(f)
+
+    def get(self, mode, table):
+        return self.state.get(mode, {}).get(table)
+
+    def set(self, mode, table, value):
+        self.state.setdefault(mode, {})[table] = value
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+def _to_text(value):
+    return "" if value is None else value
+
+def _from_text(value, kind):
+    if value == "":
+        return None
+    return kind(value)
+
+def _select_column(table, name):
+    # Story text is stored compressed in the body table, not on the row
+    if name == "story" and table in BODY_TABLES:
+        return f"story_text((SELECT body FROM {BODY_TABLES[table]} WHERE story_id = {table}.id))"
+    return name
+
+def export_table(conn, table, directory, fmt, checkpoint, batch_size=BATCH_SIZE):
+    columns = [name for name, _ in TABLES[table]]
+    path = os.path.join(directory, f"{table}.{fmt}")
+    done = checkpoint.get("export", table) or {"last_rowid": 0, "offset": 0, "rows": 0}
+    if done.get("complete"):
+        logging.info(f"Export of {table} already complete")
+        return done["rows"]
+    with open(path, "a+", newline="", encoding="utf-8") as f:
+        # Drop anything written after the last checkpoint
+        f.truncate(done["offset"])
+        f.seek(done["offset"])
+        writer = csv.writer(f) if fmt == "csv" else None
+        if writer and done["offset"] == 0:
+            writer.writerow(columns)
+        c = conn.cursor()
+        selected = ", ".join(_select_column(table, name) for name in columns)
+        c.execute(f"SELECT rowid, {selected} FROM {table} WHERE rowid > ? ORDER BY rowid", (done["last_rowid"],))
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                if writer:
+                    writer.writerow([_to_text(v) for v in row[1:]])
+                else:
+                    f.write(json.dumps(dict(zip(columns, row[1:])), ensure_ascii=False) + "\n")
+            f.flush()
+            done = {"last_rowid": rows[-1][0], "offset": f.tell(), "rows": done["rows"] + len(rows)}
+            checkpoint.set("export", table, done)
+    checkpoint.set("export", table, {**done, "complete": True})
+    logging.info(f"Exported {done['rows']} {table} rows to {path}")
+    return done["rows"]
+
+def _read_rows(path, table, fmt):
+    """Yield (row, None) per record, or (None, error) for a record that can't be parsed."""
+    types = dict(TABLES[table])
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            # The default 128 KiB field limit is smaller than the longest valid story
+            csv.field_size_limit(max(csv.field_size_limit(), MAX_STORY_CHARS + 1))
+            records = csv.DictReader(f)
+        else:
+            records = (line for line in f if line.strip())
+        while True:
+            try:
+                record = next(records)
+                if fmt == "csv":
+                    row = {name: _from_text(record.get(name, ""), kind) for name, kind in types.items()}
+                else:
+                    record = json.loads(record)
+                    row = {name: record.get(name) for name in types}
+            except StopIteration:
+                return
+            except (csv.Error, ValueError, AttributeError) as e:
+                yield None, f"unreadable record: {e}"
+                continue
+            yield row, None
+
+def import_table(conn, table, directory, fmt, checkpoint, batch_size=BATCH_SIZE):
+    path = os.path.join(directory, f"{table}.{fmt}")
+    if not os.path.exists(path):
+        logging.info(f"No {path}, skipping {table}")
+        return 0, 0
+    columns = [name for name, _ in TABLES[table] if not (name == "story" and table in BODY_TABLES)]
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) ON CONFLICT DO NOTHING"
+    done = checkpoint.get("import", table) or {"rows": 0, "imported": 0, "rejected": 0}
+    batch = []
+    seen = 0
+
+    def commit(batch, seen):
+        with conn:
+            conn.executemany(sql, [[row[name] for name in columns] for row in batch])
+            if table in BODY_TABLES:
+                c = conn.cursor()
+                for row in batch:
+                    save_body(c, table, row["id"], row["story"], overwrite=False)
+        done.update(rows=seen, imported=done["imported"] + len(batch))
+        checkpoint.set("import", table, done)
+
+    for row, error in _read_rows(path, table, fmt):
+        seen += 1
+        if seen <= done["rows"]:
+            continue
+        error = error or validate_row(table, row)
+        if error:
+            done["rejected"] += 1
+            logging.warning(f"Rejected {table} row {seen}: {error}")
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            commit(batch, seen)
+            batch = []
+    commit(batch, seen)
+    logging.info(f"Imported {done['imported']} {table} rows from {path}, rejected {done['rejected']}")
+    return done["imported"], done["rejected"]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream union app data to or from NDJSON/CSV")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("directory")
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--tables", default=",".join(TABLES))
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--restart", action="store_true", help="ignore any saved checkpoint")
+    args = parser.parse_args(argv)
+    tables = [t for t in TABLES if t in args.tables.split(",")]
+
+    from trail_db import init_db, flush_cheers
+    from trail_leaderboard import rebuild_leaderboard
+    from trail_geo import backfill_story_coordinates
+    init_db()
+    os.makedirs(args.directory, exist_ok=True)
+    checkpoint = Checkpoint(args.directory, args.format, restart=args.restart)
+    conn = get_connection()
+    if args.command == "export":
+        flush_cheers()
+        for table in tables:
+            print(f"{table}: exported {export_table(conn, table, args.directory, args.format, checkpoint, args.batch_size)} rows")
+    else:
+        for table in tables:
+            imported, rejected = import_table(conn, table, args.directory, args.format, checkpoint, args.batch_size)
+            print(f"{table}: imported {imported} rows, rejected {rejected}")
+        if "stories" in tables:
+            with conn:
+                backfill_story_coordinates(conn.cursor())
+        if "stories" in tables or "cheers" in tables:
+            rebuild_leaderboard()
+        with conn:
+            bump_version(conn.cursor())
+            if "stories" in tables:
+                bump_version(conn.cursor(), "stories")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
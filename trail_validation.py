@@ -0,0 +1,63 @@
+import re
+from collections import namedtuple
+
+MAX_STORY_WORDS = 20000
+# Cheap length caps checked before any regex work; generous enough for
+# MAX_STORY_WORDS words of ordinary length
+MAX_TITLE_CHARS = 200
+MAX_STORY_CHARS = MAX_STORY_WORDS * 50
+MAX_USERNAME_CHARS = 64
+MAX_COMMENT_CHARS = 2000
+
+_USERNAME_INVALID = re.compile(r"[^a-zA-Z0-9_]")
+_EMAIL = re.compile(r"[^@]+@[^@]+\.[^@]+")
+_TITLE_INVALID = re.compile(r"[^a-zA-Z0-9\s.,!?]")
+_STORY_INVALID = re.compile(r"[^a-zA-Z0-9\s.,!?*]")
+
+# valid: bool; field: which input failed ("title"/"story"/...) or None;
+# reason: "empty", "too_long", "invalid_char" or "too_many_words";
+# offset: index of the first disallowed character; word_count: story words
+ValidationResult = namedtuple("ValidationResult", "valid field reason offset word_count")
+
+VALID = ValidationResult(True, None, None, None, None)
+
+def _check_chars(text, invalid, max_chars, field):
+    if not text:
+        return ValidationResult(False, field, "empty", None, None)
+    if len(text) > max_chars:
+        return ValidationResult(False, field, "too_long", None, None)
+    bad = invalid.search(text)
+    if bad:
+        return ValidationResult(False, field, "invalid_char", bad.start(), None)
+    return VALID
+
+def check_username(username):
+    return _check_chars(username, _USERNAME_INVALID, MAX_USERNAME_CHARS, "username")
+
+def check_email(email):
+    if not email or not _EMAIL.match(email):
+        return ValidationResult(False, "email", "invalid_char", None, None)
+    return VALID
+
+def check_title(title):
+    return _check_chars(title, _TITLE_INVALID, MAX_TITLE_CHARS, "title")
+
+def check_comment(comment):
+    return _check_chars(comment, _TITLE_INVALID, MAX_COMMENT_CHARS, "comment")
+
+def check_story(story):
+    result = _check_chars(story, _STORY_INVALID, MAX_STORY_CHARS, "story")
+    if not result.valid:
+        return result
+    # maxsplit bounds the work: we only need to know whether the limit is exceeded
+    word_count = len(story.split(None, MAX_STORY_WORDS))
+    if word_count > MAX_STORY_WORDS:
+        return ValidationResult(False, "story", "too_many_words", None, word_count)
+    return ValidationResult(True, None, None, None, word_count)
+
+def check_submission(title, story):
+    """Validate a story submission once; app.py and trail_db.submit_story share the result."""
+    result = check_title(title)
+    if not result.valid:
+        return result
+    return check_story(story)
@@ -0,0 +1,52 @@
+import sqlite3
+import threading
+import time
+import os
+import logging
+from trail_conn import get_connection
+
+# "sqlite" keeps the counter in the database so every gunicorn worker (and the
+# month-close cron job) agrees on it; "local" is a per-process counter for a
+# single dev server
+DATA_VERSION_BACKEND = os.environ.get("DATA_VERSION_BACKEND", "sqlite")
+
+_lock = threading.Lock()
+# name -> [version, updated_at] for the "local" backend
+_local_versions = {"data": [1, time.time()]}
+
+def init_versions(c):
+    """Create the shared version table; called from init_db inside its transaction."""
+    c.execute('''CREATE TABLE IF NOT EXISTS data_versions
+                 (name TEXT PRIMARY KEY, version INTEGER NOT NULL, updated_at REAL NOT NULL)''')
+    c.execute("INSERT OR IGNORE INTO data_versions (name, version, updated_at) VALUES ('data', 1, ?)", (time.time(),))
+
+def bump_version(c, name="data"):
+    """Mark data as changed; call inside the writing transaction so the bump commits with it.
+
+    "data" covers everything the public pages show; narrower names such as
+    "stories" (published story rows only) let caches ignore unrelated writes.
+    """
+    now = time.time()
+    if DATA_VERSION_BACKEND == "local":
+        with _lock:
+            version = _local_versions.setdefault(name, [0, now])
+            version[0] += 1
+            version[1] = now
+        return
+    c.execute('''INSERT INTO data_versions (name, version, updated_at) VALUES (?, 1, ?)
+                 ON CONFLICT (name) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at''', (name, now))
+
+def get_data_version(name="data"):
+    """Return (version, updated_at) where updated_at is a Unix timestamp."""
+    if DATA_VERSION_BACKEND == "local":
+        with _lock:
+            return tuple(_local_versions.get(name, (0, 0.0)))
+    try:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT version, updated_at FROM data_versions WHERE name = ?", (name,))
+            row = c.fetchone()
+            return tuple(row) if row else (0, 0.0)
+    except sqlite3.Error as e:
+        logging.error(f"Get data version failed: {e}")
+        return None
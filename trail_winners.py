@@ -0,0 +1,100 @@
+import sqlite3
+import sys
+import logging
+from datetime import date, datetime, timedelta
+from trail_conn import get_connection
+from trail_versions import bump_version
+
+# Share of the winners' two thirds of the prize pool, by rank
+PAYOUT_SHARES = (0.5, 0.3, 0.2)
+
+def init_winners(c):
+    """Create the month-close result tables; called from init_db inside its transaction."""
+    c.execute('''CREATE TABLE IF NOT EXISTS month_closes
+                 (month TEXT PRIMARY KEY, prize_pool REAL, closed_at TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS winners
+                 (month TEXT NOT NULL, rank INTEGER NOT NULL, story_id INTEGER, user_id INTEGER,
+                  username TEXT, title TEXT, cheers INTEGER, payout REAL,
+                  PRIMARY KEY (month, rank))''')
+
+def previous_month():
+    # The day before the 1st is always in the previous calendar month
+    return (date.today().replace(day=1) - timedelta(days=1)).strftime("%Y-%m")
+
+def close_month(month=None):
+    """Archive a month's top stories and record its winners, all in one transaction.
+
+    Safe to run repeatedly (e.g. daily from cron): once a month is closed the
+    inserts hit ON CONFLICT DO NOTHING and the stored results are left as-is.
+    Returns True when this call closed the month.
+    """
+    month = month or previous_month()
+    now = datetime.now().isoformat()
+    try:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute('''INSERT INTO month_closes (month, prize_pool, closed_at)
+                         SELECT ?, COUNT(*) * 3, ? FROM users WHERE subscribed = 1
+                         ON CONFLICT (month) DO NOTHING''', (month, now))
+            if c.rowcount == 0:
+                logging.info(f"Month {month} already closed")
+                return False
+            c.execute('''INSERT INTO winners (month, rank, story_id, user_id, username, title, cheers, payout)
+                         SELECT ranked.month, ranked.rank, ranked.id, ranked.user_id, ranked.username, ranked.title, ranked.cheers,
+                                mc.prize_pool * (2.0 / 3) * CASE ranked.rank WHEN 1 THEN ? WHEN 2 THEN ? ELSE ? END
+                         FROM (SELECT s.month, ROW_NUMBER() OVER (ORDER BY s.cheers DESC, s.id) AS rank,
+                                      s.id, s.user_id, u.username, s.title, s.cheers
+                               FROM stories s JOIN users u ON s.user_id = u.id
+                               WHERE s.month = ? AND s.draft = 0
+                               ORDER BY s.cheers DESC, s.id LIMIT ?) AS ranked
+                         JOIN month_closes mc ON mc.month = ranked.month
+                         WHERE true
+                         ON CONFLICT (month, rank) DO NOTHING''',
+                      (*PAYOUT_SHARES, month, len(PAYOUT_SHARES)))
+            winner_count = c.rowcount
+            # Compressed bodies are copied as-is; the archive row keeps the same id
+            c.execute('''INSERT INTO archived_story_bodies (story_id, body)
+                         SELECT b.story_id, b.body FROM winners w JOIN story_bodies b ON b.story_id = w.story_id
+                         WHERE w.month = ?
+                         ON CONFLICT (story_id) DO NOTHING''', (month,))
+            c.execute('''INSERT INTO archived_stories (id, user_id, title, cheers, month, image_path, archived_at, location, excerpt, word_count)
+                         SELECT s.id, s.user_id, s.title, s.cheers, s.month, s.image_path, ?, s.location, s.excerpt, s.word_count
+                         FROM winners w JOIN stories s ON s.id = w.story_id
+                         WHERE w.month = ?
+                         ON CONFLICT (id) DO NOTHING''', (now, month))
+            logging.info(f"Closed month {month}: {winner_count} winners, {c.rowcount} stories archived")
+            bump_version(c)
+            return True
+    except sqlite3.Error as e:
+        logging.error(f"Close month failed: {e}")
+        return False
+
+def get_winner_info(month=None):
+    """Format the stored results of a closed month for the /winner page."""
+    month = month or previous_month()
+    try:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT 1 FROM month_closes WHERE month = ?", (month,))
+            if not c.fetchone():
+                return f"Winners for {month} not announced yet / Ganadores de {month} aún no anunciados"
+            c.execute("SELECT rank, username, title, cheers, payout FROM winners WHERE month = ? ORDER BY rank", (month,))
+            winners = c.fetchall()
+            if not winners:
+                return "No stories last month / No hay historias del último mes"
+            return "\n".join(f"#{rank}: {username} with '{title}' ({cheers} cheers) - ${payout:.2f} / #{rank}: {username} con '{title}' ({cheers} aplausos) - ${payout:.2f}"
+                             for rank, username, title, cheers, payout in winners)
+    except sqlite3.Error as e:
+        logging.error(f"Get winner info failed: {e}")
+        return "Database error / Error de base de datos"
+
+if __name__ == "__main__":
+    # Month-close job, e.g. from cron: python trail_winners.py close [YYYY-MM]
+    if len(sys.argv) < 2 or sys.argv[1] != "close":
+        print("Usage: python trail_winners.py close [YYYY-MM]")
+        sys.exit(2)
+    from trail_db import init_db
+    init_db()
+    month = sys.argv[2] if len(sys.argv) > 2 else None
+    close_month(month)
+    print(get_winner_info(month))